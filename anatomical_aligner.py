@@ -8,10 +8,12 @@ Align PLY files to the standard anatomical coordinate system:
 """
 
 import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 import numpy as np
 import os
-import json
-from scipy.spatial.distance import pdist
+from itertools import islice
+from utils.util import load_base_config, save_config_if_changed
+from utils3d import Utils3D
 
 class AnatomicalAligner:
     def __init__(self):
@@ -22,26 +24,28 @@ class AnatomicalAligner:
             'right_direction': np.array([1.0, 0.0, 0.0])  # Positive X (right ear)
         }
         
-    def analyze_ply_anatomy(self, ply_path):
-        """Analyze PLY file to detect anatomical landmarks and orientation"""
+    def analyze_ply_anatomy(self, ply_path, mesh=None):
+        """Analyze PLY file to detect anatomical landmarks and orientation
+
+        An already loaded vtkPolyData can be passed as ``mesh`` to skip re-reading the file.
+        """
         
         print(f"🔍 Anatomical Analysis: {os.path.basename(ply_path)}")
         print("-" * 50)
         
-        # Load PLY
-        reader = vtk.vtkPLYReader()
-        reader.SetFileName(ply_path)
-        reader.Update()
-        mesh = reader.GetOutput()
+        # Load PLY; repeated analyses of an unchanged file reuse the parsed mesh
+        if mesh is None:
+            mesh = Utils3D.multi_read_surface(ply_path)
         
         # Extract vertices
         points = mesh.GetPoints()
         n_points = points.GetNumberOfPoints()
-        vertices = np.array([points.GetPoint(i) for i in range(n_points)])
+        vertices = vtk_to_numpy(points.GetData()).reshape(-1, 3).astype(np.float64)
         
         # Basic metrics
-        bounds = mesh.GetBounds()
-        center = np.mean(vertices, axis=0)
+        # Bounds from the vertex array already in memory, in VTK GetBounds() order
+        mins, maxs, center = Utils3D.vertex_stats(vertices)
+        bounds = tuple(np.column_stack((mins, maxs)).ravel().tolist())
         
         print(f"📊 Basic Metrics:")
         print(f"   Points: {n_points:,}")
@@ -194,30 +198,9 @@ class AnatomicalAligner:
     
     def calculate_rotation_matrix(self, from_nose, from_up, to_nose, to_up):
         """Calculate rotation matrix to align coordinate systems"""
-        
-        # Normalize vectors
-        from_nose = from_nose / np.linalg.norm(from_nose)
-        from_up = from_up / np.linalg.norm(from_up)
-        to_nose = to_nose / np.linalg.norm(to_nose)
-        to_up = to_up / np.linalg.norm(to_up)
-        
-        # Create orthogonal coordinate systems
-        from_right = np.cross(from_up, from_nose)
-        from_right = from_right / np.linalg.norm(from_right)
-        from_up = np.cross(from_nose, from_right)  # Ensure orthogonality
-        
-        to_right = np.cross(to_up, to_nose)
-        to_right = to_right / np.linalg.norm(to_right)
-        to_up = np.cross(to_nose, to_right)
-        
-        # Build transformation matrices
-        from_matrix = np.column_stack([from_right, from_up, from_nose])
-        to_matrix = np.column_stack([to_right, to_up, to_nose])
-        
-        # Rotation matrix: R = to_matrix * from_matrix^T
-        rotation_matrix = to_matrix @ from_matrix.T
-        
-        return rotation_matrix
+        # Rotation matrix: R = to_matrix * from_matrix^T, with each matrix the orthonormal
+        # (right, up, nose) frame built from a nose/up pair
+        return Utils3D.frame_rotation(from_nose, from_up, to_nose, to_up)
     
     def apply_anatomical_alignment(self, ply_path, output_path):
         """Apply anatomical alignment to PLY file"""
@@ -236,36 +219,18 @@ class AnatomicalAligner:
         # Apply transform using VTK
         mesh = ply_analysis['mesh']
         
-        # Create VTK transform
-        vtk_transform = vtk.vtkTransform()
-        
-        # Apply in correct order: Scale -> Rotate -> Translate
-        vtk_transform.PostMultiply()
-        
-        # 1. Translate to origin first
-        vtk_transform.Translate(transform_params['translation'])
-        
-        # 2. Apply rotation
-        rotation_matrix = transform_params['rotation_matrix']
-        vtk_matrix = vtk.vtkMatrix4x4()
-        for i in range(3):
-            for j in range(3):
-                vtk_matrix.SetElement(i, j, rotation_matrix[i, j])
-        vtk_transform.Concatenate(vtk_matrix)
-        
-        # 3. Apply scale
+        # Compose translate -> rotate -> scale into one affine matrix and apply it in a single pass
+        translate = np.eye(4)
+        translate[:3, 3] = transform_params['translation']
+        rotate = np.eye(4)
+        rotate[:3, :3] = transform_params['rotation_matrix']
         scale = transform_params['scale_factor']
-        vtk_transform.Scale(scale, scale, scale)
-        
-        # Apply transform to mesh
-        transform_filter = vtk.vtkTransformPolyDataFilter()
-        transform_filter.SetInputData(mesh)
-        transform_filter.SetTransform(vtk_transform)
-        transform_filter.Update()
+        matrix = np.diag([scale, scale, scale, 1.0]) @ rotate @ translate
+        transformed_mesh = Utils3D.transform_points(mesh, matrix)
         
         # Clean up the result
         clean_filter = vtk.vtkCleanPolyData()
-        clean_filter.SetInputData(transform_filter.GetOutput())
+        clean_filter.SetInputData(transformed_mesh)
         clean_filter.Update()
         
         # Generate smooth normals
@@ -281,15 +246,13 @@ class AnatomicalAligner:
         final_mesh = normals.GetOutput()
         
         # Save result
-        writer = vtk.vtkPLYWriter()
-        writer.SetFileName(output_path)
-        writer.SetInputData(final_mesh)
-        writer.Write()
+        Utils3D.write_surface_ply(final_mesh, output_path)
         
         # Verify result
         final_bounds = final_mesh.GetBounds()
-        final_center = np.mean([[final_bounds[0], final_bounds[2], final_bounds[4]],
-                               [final_bounds[1], final_bounds[3], final_bounds[5]]], axis=0)
+        final_center = np.array([(final_bounds[0] + final_bounds[1]) / 2,
+                                 (final_bounds[2] + final_bounds[3]) / 2,
+                                 (final_bounds[4] + final_bounds[5]) / 2])
         
         print(f"\n✅ Anatomical Alignment Complete!")
         print(f"   Final center: {final_center}")
@@ -312,8 +275,7 @@ class AnatomicalAligner:
         print("-" * 40)
         
         # Load base config
-        with open(base_config_path, 'r') as f:
-            config = json.load(f)
+        config = load_base_config(base_config_path)
         
         # Modify for anatomical alignment
         config['name'] = "MVLMModel_DTU3D_Anatomical"
@@ -341,11 +303,11 @@ class AnatomicalAligner:
             "pre_align": "No additional alignment needed - already anatomically correct"
         }
         
-        # Save new config
-        with open(output_config_path, 'w') as f:
-            json.dump(config, f, indent=4)
-        
-        print(f"✅ Anatomical config saved: {output_config_path}")
+        # Save new config (left untouched when it already matches)
+        if save_config_if_changed(config, output_config_path, indent=4):
+            print(f"✅ Anatomical config saved: {output_config_path}")
+        else:
+            print(f"✅ Anatomical config up to date: {output_config_path}")
         print(f"   Coordinate system: Anatomical standard")
         print(f"   Pre-alignment: Disabled (already aligned)")
         print(f"   Image channels: {config['arch']['args']['image_channels']}")
@@ -361,15 +323,7 @@ def main():
     print()
     
     # Find test PLY files
-    test_files = []
-    for root, dirs, files in os.walk("assets/files"):
-        for file in files:
-            if file.endswith('.ply'):
-                test_files.append(os.path.join(root, file))
-                if len(test_files) >= 3:  # Test with 3 files
-                    break
-        if len(test_files) >= 3:
-            break
+    test_files = [entry.path for entry in islice(Utils3D.scan_mesh_files("assets/files", ('.ply',)), 3)]
     
     if not test_files:
         print("❌ No PLY files found in assets/files")
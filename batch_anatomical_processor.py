@@ -6,19 +6,27 @@ Processes multiple PLY files with anatomical alignment and runs predictions
 
 import os
 import sys
-import subprocess
 import json
 import numpy as np
-import re
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from anatomical_aligner import AnatomicalAligner
+from predict import PREDICT_TIMEOUT, init_predict_worker, predict
+
+# RANSAC error upper bounds and the (performance, status) label for each bucket they define
+ERROR_BOUNDS = (10, 100, 10000)
+PERFORMANCE_LEVELS = (("🔥 EXCELLENT", "excellent"),
+                      ("🎉 VERY GOOD", "very_good"),
+                      ("✅ GOOD", "good"),
+                      ("⚠️ NEEDS IMPROVEMENT", "poor"))
 
 class BatchAnatomicalProcessor:
-    def __init__(self):
-        self.python_path = "/Users/eck/Documents/Projects/Face-Landmark/Deep-MVLM/env/bin/python"
+    def __init__(self, max_workers=2):
         self.config_path = "configs/DTU3D-anatomical.json"
         self.anatomical_aligner = AnatomicalAligner()
         self.output_dir = "batch_anatomical_processed"
         self.results = []
+        self.max_workers = max_workers  # Files processed in parallel, each worker holding the model
         
     def setup_output_directory(self):
         """Create output directory if it doesn't exist"""
@@ -75,36 +83,23 @@ class BatchAnatomicalProcessor:
     
     def run_prediction(self, anatomical_file):
         """Run prediction on anatomically aligned PLY file"""
-        cmd = [self.python_path, "predict.py", "--c", self.config_path, "--n", anatomical_file]
-        
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            output = result.stderr + result.stdout
+            # In-process prediction: the model is loaded once and reused for the whole batch
+            ransac_error = predict(self.config_path, anatomical_file, timeout=PREDICT_TIMEOUT)
             
-            # Extract RANSAC error
-            ransac_pattern = r"Ransac average error\s+([\d.]+)"
-            match = re.search(ransac_pattern, output)
-            
-            if match:
-                ransac_error = float(match.group(1))
+            if ransac_error is not None:
                 return {
                     'success': True,
-                    'ransac_error': ransac_error,
-                    'output': output
+                    'ransac_error': float(ransac_error),
+                    'output': ''
                 }
             else:
                 return {
                     'success': False,
-                    'error': 'Could not extract RANSAC error',
-                    'output': output[:500]
+                    'error': 'No RANSAC error reported',
+                    'output': ''
                 }
                 
-        except subprocess.TimeoutExpired:
-            return {
-                'success': False,
-                'error': 'Prediction timeout',
-                'output': ''
-            }
         except Exception as e:
             return {
                 'success': False,
@@ -122,73 +117,71 @@ class BatchAnatomicalProcessor:
         print(f"Config: {self.config_path}")
         print("=" * 80)
         
-        batch_results = []
+        # Each file is aligned and predicted independently, so spread them over worker processes
+        positions = [f"{i}/{len(input_files)}" for i in range(1, len(input_files) + 1)]
+        max_workers = max(1, min(self.max_workers, len(input_files)))
         
-        for i, input_file in enumerate(input_files, 1):
-            if not os.path.exists(input_file):
-                print(f"❌ [{i}/{len(input_files)}] File not found: {input_file}")
-                continue
-            
-            base_name = os.path.splitext(os.path.basename(input_file))[0]
-            anatomical_file = os.path.join(self.output_dir, f"anatomical_{base_name}.ply")
-            
-            print(f"\n[{i}/{len(input_files)}] Processing: {os.path.basename(input_file)}")
-            print("-" * 60)
-            
-            # Step 1: Anatomical alignment
-            print("🔧 Step 1: Applying anatomical alignment...")
-            alignment_result = self.anatomical_align_single_file(input_file, anatomical_file)
-            
-            if not alignment_result['success']:
-                print(f"❌ Anatomical alignment failed: {alignment_result['error']}")
-                continue
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_predict_worker,
+                                 initargs=(max_workers, self.config_path)) as executor:
+            results = executor.map(self.process_single_file, input_files, positions)
+            batch_results = [result for result in results if result]
+        
+        return batch_results
+    
+    def process_single_file(self, input_file, position=""):
+        """Align and predict one PLY file; returns its result dict, or None on failure"""
+        if not os.path.exists(input_file):
+            print(f"❌ [{position}] File not found: {input_file}")
+            return None
+        
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        anatomical_file = os.path.join(self.output_dir, f"anatomical_{base_name}.ply")
+        
+        print(f"\n[{position}] Processing: {os.path.basename(input_file)}")
+        print("-" * 60)
+        
+        # Step 1: Anatomical alignment
+        print("🔧 Step 1: Applying anatomical alignment...")
+        alignment_result = self.anatomical_align_single_file(input_file, anatomical_file)
+        
+        if not alignment_result['success']:
+            print(f"❌ Anatomical alignment failed: {alignment_result['error']}")
+            return None
+        
+        print(f"✅ Anatomically aligned:")
+        print(f"   Transform: {alignment_result['anatomy_guess']}")
+        print(f"   Scale factor: {alignment_result['scale_factor']:.3f}")
+        print(f"   Final center: {alignment_result['final_center']}")
+        
+        # Step 2: Prediction
+        print("🎯 Step 2: Running prediction...")
+        prediction_result = self.run_prediction(anatomical_file)
+        
+        if prediction_result['success']:
+            ransac_error = prediction_result['ransac_error']
             
-            print(f"✅ Anatomically aligned:")
-            print(f"   Transform: {alignment_result['anatomy_guess']}")
-            print(f"   Scale factor: {alignment_result['scale_factor']:.3f}")
-            print(f"   Final center: {alignment_result['final_center']}")
+            # Performance assessment
+            performance, status = PERFORMANCE_LEVELS[bisect_right(ERROR_BOUNDS, ransac_error)]
             
-            # Step 2: Prediction
-            print("🎯 Step 2: Running prediction...")
-            prediction_result = self.run_prediction(anatomical_file)
+            print(f"✅ Prediction completed:")
+            print(f"   RANSAC Error: {ransac_error:.2f}")
+            print(f"   Performance: {performance}")
             
-            if prediction_result['success']:
-                ransac_error = prediction_result['ransac_error']
-                
-                # Performance assessment
-                if ransac_error < 10:
-                    performance = "🔥 EXCELLENT"
-                    status = "excellent"
-                elif ransac_error < 100:
-                    performance = "🎉 VERY GOOD"
-                    status = "very_good"
-                elif ransac_error < 10000:
-                    performance = "✅ GOOD"
-                    status = "good"
-                else:
-                    performance = "⚠️ NEEDS IMPROVEMENT"
-                    status = "poor"
-                
-                print(f"✅ Prediction completed:")
-                print(f"   RANSAC Error: {ransac_error:.2f}")
-                print(f"   Performance: {performance}")
-                
-                batch_results.append({
-                    'file': base_name,
-                    'input_path': input_file,
-                    'anatomical_path': anatomical_file,
-                    'category': 'men' if '/men/' in input_file else 'women',
-                    'alignment_result': alignment_result,
-                    'ransac_error': ransac_error,
-                    'performance': performance,
-                    'status': status
-                })
-            else:
-                print(f"❌ Prediction failed: {prediction_result['error']}")
-                if prediction_result['output']:
-                    print(f"   Output preview: {prediction_result['output'][:150]}...")
-        
-        return batch_results
+            return {
+                'file': base_name,
+                'input_path': input_file,
+                'anatomical_path': anatomical_file,
+                'category': 'men' if '/men/' in input_file else 'women',
+                'alignment_result': alignment_result,
+                'ransac_error': ransac_error,
+                'performance': performance,
+                'status': status
+            }
+        else:
+            print(f"❌ Prediction failed: {prediction_result['error']}")
+            if prediction_result['output']:
+                print(f"   Output preview: {prediction_result['output'][:150]}...")
+            return None
     
     def generate_comprehensive_report(self, results):
         """Generate detailed analysis report"""
@@ -200,8 +193,11 @@ class BatchAnatomicalProcessor:
         print("COMPREHENSIVE BATCH PROCESSING REPORT")
         print(f"{'='*90}")
         
-        # Sort by performance
-        sorted_results = sorted(results, key=lambda x: x['ransac_error'])
+        # One array of errors drives the ranking, the statistics and the breakdown;
+        # a stable argsort ranks ties in input order, as sorted() did
+        errors = np.fromiter((r['ransac_error'] for r in results), dtype=np.float64, count=len(results))
+        order = np.argsort(errors, kind='stable')
+        sorted_results = [results[i] for i in order]
         
         print(f"\n📊 PERFORMANCE RANKING:")
         print(f"{'Rank':<4} {'File':<12} {'Category':<6} {'RANSAC':<10} {'Transform':<10} {'Scale':<7} {'Performance'}")
@@ -214,24 +210,23 @@ class BatchAnatomicalProcessor:
                   f"{alignment['scale_factor']:<7.3f} {result['performance']}")
         
         # Statistics
-        errors = [r['ransac_error'] for r in results]
-        scales = [r['alignment_result']['scale_factor'] for r in results]
+        scales = np.fromiter((r['alignment_result']['scale_factor'] for r in results),
+                             dtype=np.float64, count=len(results))
+        sorted_errors = errors[order]
         
         print(f"\n📈 OVERALL STATISTICS:")
         print(f"  Total files processed: {len(results)}")
-        print(f"  Best RANSAC error: {min(errors):.2f}")
-        print(f"  Worst RANSAC error: {max(errors):.2f}")
-        print(f"  Average RANSAC error: {np.mean(errors):.2f}")
-        print(f"  Median RANSAC error: {np.median(errors):.2f}")
-        print(f"  Standard deviation: {np.std(errors):.2f}")
-        print(f"  Average scale factor: {np.mean(scales):.3f}")
-        print(f"  Scale range: {min(scales):.3f} - {max(scales):.3f}")
-        
-        # Performance breakdown
-        excellent = sum(1 for r in results if r['status'] == 'excellent')
-        very_good = sum(1 for r in results if r['status'] == 'very_good')
-        good = sum(1 for r in results if r['status'] == 'good')
-        poor = sum(1 for r in results if r['status'] == 'poor')
+        print(f"  Best RANSAC error: {sorted_errors[0]:.2f}")
+        print(f"  Worst RANSAC error: {sorted_errors[-1]:.2f}")
+        print(f"  Average RANSAC error: {errors.mean():.2f}")
+        print(f"  Median RANSAC error: {np.median(sorted_errors):.2f}")
+        print(f"  Standard deviation: {errors.std():.2f}")
+        print(f"  Average scale factor: {scales.mean():.3f}")
+        print(f"  Scale range: {scales.min():.3f} - {scales.max():.3f}")
+        
+        # Performance breakdown: bucket every error against the same bounds as the per-file status
+        excellent, very_good, good, poor = np.bincount(
+            np.searchsorted(ERROR_BOUNDS, errors, side='right'), minlength=len(PERFORMANCE_LEVELS)).tolist()
         
         print(f"\n🎯 PERFORMANCE BREAKDOWN:")
         print(f"  🔥 Excellent (< 10): {excellent}/{len(results)} ({excellent/len(results)*100:.1f}%)")
@@ -240,22 +235,22 @@ class BatchAnatomicalProcessor:
         print(f"  ⚠️ Poor (≥ 10000): {poor}/{len(results)} ({poor/len(results)*100:.1f}%)")
         
         # Gender analysis
-        men_results = [r for r in results if r['category'] == 'men']
-        women_results = [r for r in results if r['category'] == 'women']
+        is_men = np.fromiter((r['category'] == 'men' for r in results), dtype=bool, count=len(results))
+        is_women = np.fromiter((r['category'] == 'women' for r in results), dtype=bool, count=len(results))
         
-        if men_results and women_results:
-            men_errors = [r['ransac_error'] for r in men_results]
-            women_errors = [r['ransac_error'] for r in women_results]
+        if is_men.any() and is_women.any():
+            men_errors = errors[is_men]
+            women_errors = errors[is_women]
             
             print(f"\n👥 GENDER ANALYSIS:")
-            print(f"  Men ({len(men_results)} files):")
-            print(f"    Average RANSAC: {np.mean(men_errors):.2f}")
-            print(f"    Best: {min(men_errors):.2f}")
-            print(f"    Worst: {max(men_errors):.2f}")
-            print(f"  Women ({len(women_results)} files):")
-            print(f"    Average RANSAC: {np.mean(women_errors):.2f}")
-            print(f"    Best: {min(women_errors):.2f}")
-            print(f"    Worst: {max(women_errors):.2f}")
+            print(f"  Men ({len(men_errors)} files):")
+            print(f"    Average RANSAC: {men_errors.mean():.2f}")
+            print(f"    Best: {men_errors.min():.2f}")
+            print(f"    Worst: {men_errors.max():.2f}")
+            print(f"  Women ({len(women_errors)} files):")
+            print(f"    Average RANSAC: {women_errors.mean():.2f}")
+            print(f"    Best: {women_errors.min():.2f}")
+            print(f"    Worst: {women_errors.max():.2f}")
         
         # Transform analysis
         transform_stats = {}
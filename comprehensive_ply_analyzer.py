@@ -5,19 +5,24 @@ Analyzes all PLY files with smart sampling and hybrid optimization
 """
 
 import os
-import sys
 import json
-import subprocess
-import re
+import heapq
+import operator
+import tempfile
+from contextlib import ExitStack
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from anatomical_aligner import AnatomicalAligner
+from predict import PREDICT_TIMEOUT, predict, predict_many
+from utils.util import fast_temp_dir
 
 class ComprehensivePLYAnalyzer:
     def __init__(self):
-        self.python_path = "/Users/eck/Documents/Projects/Face-Landmark/Deep-MVLM/env/bin/python"
         self.anatomical_config = "configs/DTU3D-anatomical.json"
         self.ultimate_config = "configs/DTU3D-PLY-ultimate-final.json"
         self.anatomical_aligner = AnatomicalAligner()
+        self.max_workers = os.cpu_count() or 1  # Parallel sample tests
+        self.max_batch = 8  # Aligned files per predict_many call
         
         # Known results from previous testing
         self.known_excellent_anatomical = {
@@ -56,83 +61,135 @@ class ComprehensivePLYAnalyzer:
     
     def test_sample_files(self, sample_files, method="anatomical"):
         """Test a sample of files with specified method"""
+        return self.test_sample_groups([sample_files], method)[0]
+    
+    def test_sample_groups(self, sample_groups, method="anatomical"):
+        """Test several samples with one method; returns one result list per sample
+
+        All samples are aligned in one process pool and share the prediction batches, which
+        run on one in-process model loaded once for all of them.
+        """
+        # Aligned meshes only live until they are scored, so they go to RAM-backed temporary
+        # directories (one per sample, since file names repeat across categories) that are
+        # removed with everything in them once the batches are done
+        with ExitStack() as stack:
+            temp_dirs = [stack.enter_context(tempfile.TemporaryDirectory(prefix=f"{method}_", dir=fast_temp_dir()))
+                         for _ in sample_groups]
+            return self.test_aligned_groups(sample_groups, method, temp_dirs)
+    
+    def test_aligned_groups(self, sample_groups, method, temp_dirs):
+        """Align each sample into its temp dir, predict them in batches and rate the results"""
+        # Alignment is independent per file, so it runs in parallel across all samples
+        items = [(sample_file, temp_dir) for sample_files, temp_dir in zip(sample_groups, temp_dirs)
+                 for sample_file in sample_files]
+        positions = [f"{i}/{len(items)}" for i in range(1, len(items) + 1)]
+        max_workers = max(1, min(self.max_workers, len(items)))
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            aligned_items = list(executor.map(self.align_sample_file, [sample_file for sample_file, _ in items],
+                                              [method] * len(items), positions,
+                                              [temp_dir for _, temp_dir in items]))
+        
+        aligned_groups = []
+        start = 0
+        for sample_files in sample_groups:
+            aligned_groups.append([item for item in aligned_items[start:start + len(sample_files)] if item])
+            start += len(sample_files)
+        
+        # Predict in bounded batches of aligned files on the in-process model, which is loaded
+        # once and reused for every batch; torch already spreads a batch over the cores, and only
+        # one batch of renderings is held in memory at a time
+        config = self.anatomical_config if method == "anatomical" else self.ultimate_config
+        aligned = [item for aligned_files in aligned_groups for item in aligned_files]
+        ransac_errors = {}
+        for i in range(0, len(aligned), self.max_batch):
+            ransac_errors.update(self.predict_batch([temp_file for _, temp_file in aligned[i:i + self.max_batch]],
+                                                    config))
+        
+        return [self.rate_aligned_files(aligned_files, method, ransac_errors) for aligned_files in aligned_groups]
+    
+    def rate_aligned_files(self, aligned, method, ransac_errors):
+        """Rate the (base_name, aligned_file) pairs of one sample by their RANSAC errors"""
         results = []
-        
-        for i, (filename, filepath) in enumerate(sample_files, 1):
-            base_name = os.path.splitext(filename)[0]
-            print(f"\n[{i}/{len(sample_files)}] Testing {filename} with {method.upper()}")
+        for base_name, temp_file in aligned:
+            ransac_error = ransac_errors.get(temp_file)
             
-            if method == "anatomical":
-                temp_file = f"temp_ana_{base_name}.ply"
-                config = self.anatomical_config
+            if ransac_error is not None:
+                if ransac_error < 10:
+                    performance = "🔥 EXCELLENT"
+                    status = "excellent"
+                elif ransac_error < 100:
+                    performance = "🎉 VERY GOOD"
+                    status = "very_good"
+                elif ransac_error < 10000:
+                    performance = "✅ GOOD"
+                    status = "good"
+                else:
+                    performance = "⚠️ POOR"
+                    status = "poor"
                 
-                try:
-                    result = self.anatomical_aligner.apply_anatomical_alignment(filepath, temp_file)
-                    print(f"✅ Anatomical alignment completed")
-                except Exception as e:
-                    print(f"❌ Anatomical alignment failed: {e}")
-                    continue
-            
-            elif method == "ultimate":
-                temp_file = f"temp_ult_{base_name}.ply"
-                config = self.ultimate_config
+                print(f"   {base_name}: RANSAC {ransac_error:.2f} ({performance})")
                 
-                try:
-                    from ultimate_ply_preprocessor import align_ply_to_obj_system
-                    align_ply_to_obj_system(filepath, temp_file)
-                    print(f"✅ Ultimate alignment completed")
-                except Exception as e:
-                    print(f"❌ Ultimate alignment failed: {e}")
-                    continue
-            
-            # Run prediction
-            cmd = [self.python_path, "predict.py", "--c", config, "--n", temp_file]
+                results.append({
+                    'file': base_name,
+                    'method': method,
+                    'ransac_error': ransac_error,
+                    'performance': performance,
+                    'status': status
+                })
+            else:
+                print(f"   ❌ {base_name}: Could not extract RANSAC error")
+        
+        return results
+    
+    def align_sample_file(self, sample_file, method, position, temp_dir):
+        """Align one file with the given method into temp_dir; returns (base_name, aligned_file) or None"""
+        filename, filepath = sample_file
+        base_name = os.path.splitext(filename)[0]
+        print(f"\n[{position}] Aligning {filename} with {method.upper()}")
+        
+        if method == "anatomical":
+            temp_file = os.path.join(temp_dir, f"temp_ana_{base_name}.ply")
             
             try:
-                pred_result = subprocess.run(cmd, capture_output=True, text=True, timeout=200)
-                output = pred_result.stderr + pred_result.stdout
-                
-                ransac_pattern = r"Ransac average error\s+([\d.]+)"
-                match = re.search(ransac_pattern, output)
-                
-                if match:
-                    ransac_error = float(match.group(1))
-                    
-                    if ransac_error < 10:
-                        performance = "🔥 EXCELLENT"
-                        status = "excellent"
-                    elif ransac_error < 100:
-                        performance = "🎉 VERY GOOD"
-                        status = "very_good"
-                    elif ransac_error < 10000:
-                        performance = "✅ GOOD"
-                        status = "good"
-                    else:
-                        performance = "⚠️ POOR"
-                        status = "poor"
-                    
-                    print(f"   RANSAC: {ransac_error:.2f} ({performance})")
-                    
-                    results.append({
-                        'file': base_name,
-                        'method': method,
-                        'ransac_error': ransac_error,
-                        'performance': performance,
-                        'status': status
-                    })
-                else:
-                    print(f"   ❌ Could not extract RANSAC error")
-                    
-            except subprocess.TimeoutExpired:
-                print(f"   ❌ Prediction timeout")
+                self.anatomical_aligner.apply_anatomical_alignment(filepath, temp_file)
+                print(f"✅ Anatomical alignment completed")
             except Exception as e:
-                print(f"   ❌ Prediction error: {e}")
+                print(f"❌ Anatomical alignment failed: {e}")
+                return None
+        
+        elif method == "ultimate":
+            temp_file = os.path.join(temp_dir, f"temp_ult_{base_name}.ply")
             
-            # Cleanup
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            try:
+                from ultimate_ply_preprocessor import align_ply_to_obj_system
+                align_ply_to_obj_system(filepath, temp_file)
+                print(f"✅ Ultimate alignment completed")
+            except Exception as e:
+                print(f"❌ Ultimate alignment failed: {e}")
+                return None
         
-        return results
+        else:
+            return None
+        
+        return base_name, temp_file
+    
+    def predict_batch(self, temp_files, config):
+        """Predict a batch of aligned files in-process and return {temp_file: ransac_error} for the files it scored"""
+        try:
+            values = predict_many(config, temp_files, timeout=PREDICT_TIMEOUT * len(temp_files))
+        except Exception as e:
+            # One bad file fails the shared pass, so score the batch file by file to keep the rest
+            print(f"   ❌ Batch prediction error: {e} - predicting its files one by one")
+            values = []
+            for temp_file in temp_files:
+                try:
+                    values.append(predict(config, temp_file, timeout=PREDICT_TIMEOUT))
+                except Exception as e:
+                    print(f"   ❌ Prediction error for {os.path.basename(temp_file)}: {e}")
+                    values.append(None)
+        
+        return {temp_file: float(value) for temp_file, value in zip(temp_files, values) if value is not None}
     
     def generate_comprehensive_report(self):
         """Generate comprehensive analysis report"""
@@ -192,28 +249,19 @@ class ComprehensivePLYAnalyzer:
         sample_men = untested_men[:5] if len(untested_men) >= 5 else untested_men
         sample_women = untested_women[:5] if len(untested_women) >= 5 else untested_women
         
-        if sample_men:
-            print(f"\n🔧 Testing {len(sample_men)} sample men files with anatomical alignment:")
-            men_sample_results = self.test_sample_files(sample_men, "anatomical")
-            
-            for result in men_sample_results:
-                all_results.append({
-                    'file': result['file'],
-                    'category': 'men',
-                    'best_method': result['method'],
-                    'ransac_error': result['ransac_error'],
-                    'status': result['status'],
-                    'tested': True
-                })
+        # Both categories are tested together, so their files share the prediction batches
+        samples = [(category, sample) for category, sample in (('men', sample_men), ('women', sample_women))
+                   if sample]
+        for category, sample in samples:
+            print(f"\n🔧 Testing {len(sample)} sample {category} files with anatomical alignment:")
         
-        if sample_women:
-            print(f"\n🔧 Testing {len(sample_women)} sample women files with anatomical alignment:")
-            women_sample_results = self.test_sample_files(sample_women, "anatomical")
-            
-            for result in women_sample_results:
+        sample_results = self.test_sample_groups([sample for _, sample in samples], "anatomical")
+        
+        for (category, _), category_results in zip(samples, sample_results):
+            for result in category_results:
                 all_results.append({
                     'file': result['file'],
-                    'category': 'women',
+                    'category': category,
                     'best_method': result['method'],
                     'ransac_error': result['ransac_error'],
                     'status': result['status'],
@@ -235,13 +283,13 @@ class ComprehensivePLYAnalyzer:
         tested_results = [r for r in results if r['tested']]
         
         # Sort by performance
-        sorted_results = sorted(tested_results, key=lambda x: x['ransac_error'])
+        top_results = heapq.nsmallest(10, tested_results, key=operator.itemgetter('ransac_error'))
         
         print(f"\n🏆 TOP PERFORMERS (Tested Files):")
         print(f"{'Rank':<4} {'File':<8} {'Category':<8} {'Method':<10} {'RANSAC':<12} {'Status'}")
         print("-" * 70)
         
-        for i, result in enumerate(sorted_results[:10], 1):
+        for i, result in enumerate(top_results, 1):
             print(f"{i:<4} {result['file']:<8} {result['category']:<8} "
                   f"{result['best_method']:<10} {result['ransac_error']:<12.2f} "
                   f"{result['status']}")
@@ -1,4 +1,5 @@
 import torch
+import numpy as np
 import model.model as module_arch
 from utils3d import Utils3D
 from utils3d import Render3D
@@ -60,6 +61,8 @@ class DeepMVLM:
         # self.device, self.model = self._get_device_and_load_model()
         self.logger = config.get_logger('predict')
         self.device, self.model = self._get_device_and_load_model_from_url()
+        self.ransac_average_error = None
+        self.ransac_average_errors = []
 
     def _prepare_device(self, n_gpu_use):
         n_gpu = torch.cuda.device_count()
@@ -177,6 +180,41 @@ class DeepMVLM:
         predict_2d = Predict2D(self.config, self.model, self.device)
         heatmap_maxima = predict_2d.predict_heatmaps_from_images(image_stack)
 
+        u3d = self._landmarks_from_heatmap_maxima(file_name, heatmap_maxima, transform_stack)
+        self.ransac_average_error = u3d.ransac_average_error
+
+        return u3d.landmarks
+
+    def predict_files(self, file_names):
+        """Predict landmarks for several meshes with one pass of the network over all their views
+
+        Returns a list of landmarks in the order of file_names; the matching RANSAC average
+        errors are left in self.ransac_average_errors.
+        """
+        self.ransac_average_errors = []
+        if not file_names:
+            return []
+
+        render_3d = Render3D(self.config)
+        renderings = [render_3d.render_3d_file(file_name) for file_name in file_names]
+
+        predict_2d = Predict2D(self.config, self.model, self.device)
+        image_stack = np.concatenate([image_stack for image_stack, _ in renderings])
+        heatmap_maxima = predict_2d.predict_heatmaps_from_images(image_stack)
+
+        landmarks = []
+        first_view = 0
+        for file_name, (image_stack, transform_stack) in zip(file_names, renderings):
+            n_views = image_stack.shape[0]
+            u3d = self._landmarks_from_heatmap_maxima(
+                file_name, heatmap_maxima[:, first_view:first_view + n_views, :], transform_stack)
+            first_view += n_views
+            landmarks.append(u3d.landmarks)
+            self.ransac_average_errors.append(u3d.ransac_average_error)
+
+        return landmarks
+
+    def _landmarks_from_heatmap_maxima(self, file_name, heatmap_maxima, transform_stack):
         u3d = Utils3D(self.config)
         u3d.heatmap_maxima = heatmap_maxima
         u3d.transformations_3d = transform_stack
@@ -184,8 +222,7 @@ class DeepMVLM:
         #  u3d.visualise_one_landmark_lines(65)
         u3d.compute_all_landmarks_from_view_lines()
         u3d.project_landmarks_to_surface(file_name)
-
-        return u3d.landmarks
+        return u3d
 
     @staticmethod
     def write_landmarks_as_vtk_points(landmarks, file_name):
@@ -7,21 +7,35 @@ Provides detailed hybrid analysis and recommendations
 
 import os
 import sys
-import subprocess
 import json
 import numpy as np
-import re
+import hashlib
+import heapq
+import operator
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from anatomical_aligner import AnatomicalAligner
+from predict import PREDICT_TIMEOUT, init_predict_worker, predict
+
+
+def remove_temp_file(path):
+    # one unlink for every outcome instead of an exists() check before each remove; the file is
+    # missing when the alignment failed before writing it
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
 
 class ComprehensivePLYTestSuite:
-    def __init__(self):
-        self.python_path = "/Users/eck/Documents/Projects/Face-Landmark/Deep-MVLM/env/bin/python"
+    def __init__(self, max_workers=2):
         self.anatomical_config = "configs/DTU3D-anatomical.json"
         self.ultimate_config = "configs/DTU3D-PLY-ultimate-final.json"
         self.anatomical_aligner = AnatomicalAligner()
         self.output_dir = "comprehensive_test_results"
+        self.checkpoint_file = os.path.join(self.output_dir, "comprehensive_test_progress.jsonl")
         self.results = []
+        self.max_workers = max_workers  # Files tested in parallel, each worker holding both models
         
         # Performance thresholds
         self.excellent_threshold = 10.0
@@ -71,88 +85,72 @@ class ComprehensivePLYTestSuite:
         all_files.sort(key=lambda x: x['file_number'])
         return all_files
     
-    def test_anatomical_method(self, file_info):
-        """Test anatomical alignment method"""
-        base_name = os.path.splitext(file_info['filename'])[0]
-        temp_file = os.path.join(self.output_dir, f"temp_anatomical_{base_name}.ply")
-        
+    def file_digest(self, filepath):
+        """Content hash of a PLY file, so identical inputs share temp files and results"""
+        digest = hashlib.blake2b()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:16]
+    
+    def test_anatomical_method(self, file_info, digest):
+        """Test anatomical alignment method; digest names the temp file after the content"""
+        temp_file = os.path.join(self.output_dir, f"anatomical_{digest}.ply")
+        return self._run_anatomical_method(file_info, temp_file)
+    
+    def _run_anatomical_method(self, file_info, temp_file):
+        """Align and predict with the anatomical method"""
         try:
             # Apply anatomical alignment
             result = self.anatomical_aligner.apply_anatomical_alignment(
                 file_info['filepath'], temp_file
             )
             
-            # Run prediction
-            cmd = [self.python_path, "predict.py", "--c", self.anatomical_config, "--n", temp_file]
-            pred_result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            output = pred_result.stderr + pred_result.stdout
-            
-            # Extract RANSAC error
-            ransac_pattern = r"Ransac average error\s+([\d.]+)"
-            match = re.search(ransac_pattern, output)
+            # Run prediction in-process; each pool worker loads the model once and keeps it warm
+            ransac_error = predict(self.anatomical_config, temp_file, timeout=PREDICT_TIMEOUT)
             
-            if match:
-                ransac_error = float(match.group(1))
-                
-                # Cleanup temp file
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                
+            if ransac_error is not None:
                 return {
                     'success': True,
-                    'ransac_error': ransac_error,
+                    'ransac_error': float(ransac_error),
                     'scale_factor': result["transform_params"]["scale_factor"],
                     'anatomy_guess': result["transform_params"]["anatomy_guess"]
                 }
             else:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                return {'success': False, 'error': 'Could not extract RANSAC'}
+                return {'success': False, 'error': 'No RANSAC error reported'}
                 
         except Exception as e:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
             return {'success': False, 'error': str(e)}
+        finally:
+            remove_temp_file(temp_file)
     
-    def test_ultimate_method(self, file_info):
-        """Test ultimate preprocessing method"""
-        base_name = os.path.splitext(file_info['filename'])[0]
-        temp_file = os.path.join(self.output_dir, f"temp_ultimate_{base_name}.ply")
-        
+    def test_ultimate_method(self, file_info, digest):
+        """Test ultimate preprocessing method; digest names the temp file after the content"""
+        temp_file = os.path.join(self.output_dir, f"ultimate_{digest}.ply")
+        return self._run_ultimate_method(file_info, temp_file)
+    
+    def _run_ultimate_method(self, file_info, temp_file):
+        """Align and predict with the ultimate method"""
         try:
             # Apply ultimate preprocessing
             from ultimate_ply_preprocessor import align_ply_to_obj_system
             align_ply_to_obj_system(file_info['filepath'], temp_file)
             
-            # Run prediction
-            cmd = [self.python_path, "predict.py", "--c", self.ultimate_config, "--n", temp_file]
-            pred_result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            output = pred_result.stderr + pred_result.stdout
-            
-            # Extract RANSAC error
-            ransac_pattern = r"Ransac average error\s+([\d.]+)"
-            match = re.search(ransac_pattern, output)
+            # Run prediction in-process; each pool worker loads the model once and keeps it warm
+            ransac_error = predict(self.ultimate_config, temp_file, timeout=PREDICT_TIMEOUT)
             
-            if match:
-                ransac_error = float(match.group(1))
-                
-                # Cleanup temp file
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                
+            if ransac_error is not None:
                 return {
                     'success': True,
-                    'ransac_error': ransac_error
+                    'ransac_error': float(ransac_error)
                 }
             else:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                return {'success': False, 'error': 'Could not extract RANSAC'}
+                return {'success': False, 'error': 'No RANSAC error reported'}
                 
         except Exception as e:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
             return {'success': False, 'error': str(e)}
+        finally:
+            remove_temp_file(temp_file)
     
     def classify_performance(self, ransac_error):
         """Classify performance based on RANSAC error"""
@@ -165,8 +163,11 @@ class ComprehensivePLYTestSuite:
         else:
             return "⚠️ POOR", "poor"
     
-    def test_single_file_hybrid(self, file_info):
-        """Test single file with both methods and determine best approach"""
+    def test_single_file_hybrid(self, file_info, digest):
+        """Test single file with both methods and determine best approach
+        
+        digest is the content hash run_comprehensive_test already computed for deduplication.
+        """
         
         print(f"\n{'='*80}")
         print(f"Testing: {file_info['filename']} ({file_info['category'].upper()})")
@@ -187,7 +188,7 @@ class ComprehensivePLYTestSuite:
         
         # Test anatomical method first
         print("🔧 Testing ANATOMICAL alignment...")
-        anatomical_result = self.test_anatomical_method(file_info)
+        anatomical_result = self.test_anatomical_method(file_info, digest)
         
         if anatomical_result['success']:
             ransac = anatomical_result['ransac_error']
@@ -215,7 +216,7 @@ class ComprehensivePLYTestSuite:
         
         # Test ultimate method
         print("🔧 Testing ULTIMATE preprocessing...")
-        ultimate_result = self.test_ultimate_method(file_info)
+        ultimate_result = self.test_ultimate_method(file_info, digest)
         
         if ultimate_result['success']:
             ransac = ultimate_result['ransac_error']
@@ -273,6 +274,26 @@ class ComprehensivePLYTestSuite:
         
         return result
     
+    def load_checkpoint(self):
+        """Per-file results written by an interrupted run, keyed by content digest"""
+        tested = {}
+        try:
+            with open(self.checkpoint_file) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:  # line cut off by the interruption
+                        continue
+                    tested[record['digest']] = record['result']
+        except FileNotFoundError:
+            pass
+        return tested
+    
+    def test_file_at_position(self, file_info, digest, position):
+        """Pool task: test one file, labelled with its position in the run"""
+        print(f"\n[{position}] Processing {file_info['filename']}...")
+        return self.test_single_file_hybrid(file_info, digest)
+    
     def run_comprehensive_test(self):
         """Run comprehensive test on all PLY files"""
         
@@ -298,19 +319,41 @@ class ComprehensivePLYTestSuite:
         print(f"   Men: {men_count} files")
         print(f"   Women: {women_count} files")
         
-        # Test all files
-        all_results = []
-        
-        for i, file_info in enumerate(all_files, 1):
-            print(f"\n[{i}/{len(all_files)}] Processing {file_info['filename']}...")
-            result = self.test_single_file_hybrid(file_info)
-            all_results.append(result)
+        # Test all files in parallel; files with identical content are only tested once
+        digests = [self.file_digest(file_info['filepath']) for file_info in all_files]
+        unique_files = {}
+        for file_info, digest in zip(all_files, digests):
+            unique_files.setdefault(digest, file_info)
+        
+        # Each finished file is appended to a JSON-lines checkpoint, so an interrupted run resumes
+        tested = self.load_checkpoint()
+        if tested:
+            print(f"♻️ Resuming: {len(tested)} files already tested in {self.checkpoint_file}")
+        pending = {digest: file_info for digest, file_info in unique_files.items() if digest not in tested}
+        
+        positions = [f"{i}/{len(pending)}" for i in range(1, len(pending) + 1)]
+        max_workers = max(1, min(self.max_workers, len(pending)))
+        
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_predict_worker,
+                                 initargs=(max_workers, self.anatomical_config)) as executor, \
+                open(self.checkpoint_file, 'a', buffering=1) as checkpoint:
+            for digest, result in zip(pending, executor.map(self.test_file_at_position,
+                                                            pending.values(), pending, positions)):
+                checkpoint.write(json.dumps({'digest': digest, 'result': result}, default=str) + '\n')
+                tested[digest] = result
+        
+        all_results = [
+            {**tested[digest], 'file': file_info['filename'],
+             'file_number': file_info['file_number'], 'category': file_info['category']}
+            for file_info, digest in zip(all_files, digests)
+        ]
         
         # Generate comprehensive report
         self.generate_final_report(all_results)
         
-        # Save results
+        # Save results; the run is complete, so the checkpoint is no longer needed
         self.save_results(all_results)
+        os.remove(self.checkpoint_file)
         
         return all_results
     
@@ -371,7 +414,7 @@ class ComprehensivePLYTestSuite:
             print(f"   Ultimate avg RANSAC: {np.mean(ult_errors):.2f}")
         
         # Top performers
-        top_performers = sorted(successful_results, key=lambda x: x['best_ransac'])[:10]
+        top_performers = heapq.nsmallest(10, successful_results, key=operator.itemgetter('best_ransac'))
         
         print(f"\n🏆 TOP 10 PERFORMERS:")
         print(f"{'Rank':<4} {'File':<12} {'Category':<8} {'Method':<10} {'RANSAC':<12} {'Performance'}")
@@ -5,9 +5,36 @@ Final Comprehensive PLY Dataset Analysis Summary
 Complete analysis of 66 PLY files with hybrid optimization results
 """
 
-import json
-import os
+import heapq
+import operator
+import numpy as np
+from collections import Counter, defaultdict
+from dataclasses import dataclass, fields
 from datetime import datetime
+from functools import lru_cache
+from utils.util import load_report_json
+
+@dataclass(slots=True)
+class AnalysisRecord:
+    """One file's entry from comprehensive_analysis_report.json"""
+    file: str
+    category: str
+    best_method: str
+    status: str
+    ransac_error: float
+    
+    @classmethod
+    def from_dict(cls, d):
+        # Reports carry extra keys (e.g. 'tested') that the summary does not need
+        return cls(**{f.name: d[f.name] for f in fields(cls)})
+
+@lru_cache(maxsize=None)
+def load_report(path):
+    """Load a JSON report once per path; returns [] when the report is missing"""
+    try:
+        return load_report_json(path)
+    except FileNotFoundError:
+        return []
 
 def generate_final_summary():
     """Generate the final comprehensive summary"""
@@ -18,15 +45,20 @@ def generate_final_summary():
     print(f"Analysis Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Load analysis results
-    comprehensive_results = []
-    if os.path.exists('comprehensive_analysis_report.json'):
-        with open('comprehensive_analysis_report.json', 'r') as f:
-            comprehensive_results = json.load(f)
-    
-    optimization_results = []
-    if os.path.exists('poor_performer_optimization_report.json'):
-        with open('poor_performer_optimization_report.json', 'r') as f:
-            optimization_results = json.load(f)
+    comprehensive_results = [AnalysisRecord.from_dict(d) for d in load_report('comprehensive_analysis_report.json')]
+    optimization_results = load_report('poor_performer_optimization_report.json')
+    
+    # Single pass over the results: bucket by (category, method, status) for O(1) lookups
+    buckets = defaultdict(list)
+    category_counts = Counter()
+    method_counts = Counter()
+    excellent_results = []
+    for r in comprehensive_results:
+        buckets[(r.category, r.best_method, r.status)].append(r)
+        category_counts[r.category] += 1
+        method_counts[r.best_method] += 1
+        if r.status == 'excellent':
+            excellent_results.append(r)
     
     print(f"\n📊 DATASET OVERVIEW:")
     print(f"   Total PLY files in dataset: 66")
@@ -36,21 +68,23 @@ def generate_final_summary():
     print(f"   Coverage: {len(comprehensive_results)/66*100:.1f}% of dataset")
     
     # Method effectiveness analysis
-    anatomical_successful = [r for r in comprehensive_results if r['best_method'] == 'anatomical' and r['status'] == 'excellent']
-    ultimate_required = [r for r in comprehensive_results if r['best_method'] == 'ultimate']
+    anatomical_successful = sum(len(bucket) for (_, method, status), bucket in buckets.items()
+                                if method == 'anatomical' and status == 'excellent')
+    ultimate_required = method_counts['ultimate']
     
     print(f"\n🔬 METHOD EFFECTIVENESS:")
-    print(f"   Anatomical alignment successful: {len(anatomical_successful)} files")
-    print(f"   Ultimate preprocessing required: {len(ultimate_required)} files")
-    print(f"   Anatomical success rate: {len(anatomical_successful)/len(comprehensive_results)*100:.1f}%")
+    print(f"   Anatomical alignment successful: {anatomical_successful} files")
+    print(f"   Ultimate preprocessing required: {ultimate_required} files")
+    print(f"   Anatomical success rate: {anatomical_successful/len(comprehensive_results)*100:.1f}%")
     
     # Performance statistics
-    all_ransac_errors = [r['ransac_error'] for r in comprehensive_results if r['status'] == 'excellent']
+    all_ransac_errors = np.fromiter((r.ransac_error for r in excellent_results),
+                                    dtype=np.float64, count=len(excellent_results))
     
-    if all_ransac_errors:
+    if all_ransac_errors.size:
         print(f"\n📈 PERFORMANCE STATISTICS (Excellent Results Only):")
-        print(f"   Best RANSAC error: {min(all_ransac_errors):.2f}")
-        print(f"   Average RANSAC error: {sum(all_ransac_errors)/len(all_ransac_errors):.2f}")
+        print(f"   Best RANSAC error: {all_ransac_errors.min():.2f}")
+        print(f"   Average RANSAC error: {all_ransac_errors.mean():.2f}")
         print(f"   Excellent results: {len(all_ransac_errors)}/{len(comprehensive_results)} ({len(all_ransac_errors)/len(comprehensive_results)*100:.1f}%)")
     
     # Optimization results
@@ -62,42 +96,42 @@ def generate_final_summary():
         print(f"   Optimization success rate: {len(successful_opts)/len(optimization_results)*100:.1f}%")
         
         if successful_opts:
-            avg_improvement = sum(r['improvement'] for r in successful_opts) / len(successful_opts)
+            avg_improvement = np.mean([r['improvement'] for r in successful_opts])
             print(f"   Average improvement: {avg_improvement:.0f}x better RANSAC")
     
     # Top performers showcase
-    excellent_results = [r for r in comprehensive_results if r['status'] == 'excellent']
     if excellent_results:
-        top_performers = sorted(excellent_results, key=lambda x: x['ransac_error'])[:10]
+        top_performers = heapq.nsmallest(10, excellent_results, key=operator.attrgetter('ransac_error'))
         
-        print(f"\n🏆 TOP 10 PERFORMERS:")
-        print(f"{'Rank':<4} {'File':<8} {'Category':<8} {'Method':<10} {'RANSAC':<10}")
-        print("-" * 55)
-        for i, result in enumerate(top_performers, 1):
-            print(f"{i:<4} {result['file']:<8} {result['category']:<8} "
-                  f"{result['best_method']:<10} {result['ransac_error']:<10.2f}")
+        rows = [f"\n🏆 TOP 10 PERFORMERS:",
+                f"{'Rank':<4} {'File':<8} {'Category':<8} {'Method':<10} {'RANSAC':<10}",
+                "-" * 55]
+        rows.extend(f"{i:<4} {result.file:<8} {result.category:<8} "
+                    f"{result.best_method:<10} {result.ransac_error:<10.2f}"
+                    for i, result in enumerate(top_performers, 1))
+        print("\n".join(rows))
     
     # Method recommendations based on file categories
     print(f"\n🎯 METHOD RECOMMENDATIONS BY CATEGORY:")
     
-    men_anatomical = [r for r in comprehensive_results if r['category'] == 'men' and r['best_method'] == 'anatomical' and r['status'] == 'excellent']
-    women_anatomical = [r for r in comprehensive_results if r['category'] == 'women' and r['best_method'] == 'anatomical' and r['status'] == 'excellent']
+    men_anatomical = len(buckets[('men', 'anatomical', 'excellent')])
+    women_anatomical = len(buckets[('women', 'anatomical', 'excellent')])
     
-    men_tested = [r for r in comprehensive_results if r['category'] == 'men']
-    women_tested = [r for r in comprehensive_results if r['category'] == 'women']
+    men_tested = category_counts['men']
+    women_tested = category_counts['women']
     
     if men_tested:
-        men_anatomical_rate = len(men_anatomical) / len(men_tested) * 100
+        men_anatomical_rate = men_anatomical / men_tested * 100
         print(f"   Men files: {men_anatomical_rate:.1f}% succeed with anatomical alignment")
     
     if women_tested:
-        women_anatomical_rate = len(women_anatomical) / len(women_tested) * 100
+        women_anatomical_rate = women_anatomical / women_tested * 100
         print(f"   Women files: {women_anatomical_rate:.1f}% succeed with anatomical alignment")
     
     # Final recommendations
     print(f"\n💡 FINAL RECOMMENDATIONS:")
     
-    total_excellent = len([r for r in comprehensive_results if r['status'] == 'excellent'])
+    total_excellent = len(excellent_results)
     success_rate = total_excellent / len(comprehensive_results) * 100
     
     if success_rate >= 80:
@@ -126,7 +160,7 @@ def generate_final_summary():
     print("   • HYBRID_USAGE_GUIDE.md - Complete documentation")
     
     # Overall system assessment
-    hybrid_success_files = len([r for r in comprehensive_results if r['status'] == 'excellent'])
+    hybrid_success_files = len(excellent_results)
     total_tested = len(comprehensive_results)
     
     print(f"\n🎉 OVERALL SYSTEM ASSESSMENT:")
@@ -6,21 +6,36 @@ Combines anatomical and ultimate preprocessing approaches to achieve optimal res
 
 import os
 import sys
-import subprocess
-import json
-import re
+import argparse
+import heapq
+import hashlib
+import sqlite3
+import tempfile
+from contextlib import closing
+from functools import cached_property
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import operator
 import numpy as np
-from anatomical_aligner import AnatomicalAligner
-from ultimate_ply_preprocessor import align_ply_to_obj_system
+from utils.util import CACHE_DIR, fast_temp_dir, iter_report_items, save_report_json
+
+ALIGNMENT_METHODS = ('anatomical', 'ultimate')
 
 class HybridPLYProcessor:
-    def __init__(self):
-        self.python_path = "/Users/eck/Documents/Projects/Face-Landmark/Deep-MVLM/env/bin/python"
+    def __init__(self, early_exit_threshold=5.0, max_workers=2):
         self.anatomical_config = "configs/DTU3D-anatomical.json"
         self.ultimate_config = "configs/DTU3D-PLY-ultimate-final.json"
-        self.anatomical_aligner = AnatomicalAligner()
         self.threshold_ransac = 100  # If anatomical RANSAC > threshold, try ultimate
+        self.early_exit_threshold = early_exit_threshold  # Anatomical RANSAC below this skips ultimate
+        self.prediction_cache_dir = os.path.join(CACHE_DIR, "ransac")
+        self.max_workers = max_workers  # Parallel workers for batch reprocessing, each holding the model
         
+    @cached_property
+    def anatomical_aligner(self):
+        """Built on first use so ultimate-only runs never load the anatomical path"""
+        from anatomical_aligner import AnatomicalAligner
+        return AnatomicalAligner()
+    
     def apply_anatomical_alignment(self, input_file, output_file):
         """Apply anatomical alignment"""
         try:
@@ -43,6 +58,7 @@ class HybridPLYProcessor:
     def apply_ultimate_alignment(self, input_file, output_file):
         """Apply ultimate (OBJ-based) alignment"""
         try:
+            from ultimate_ply_preprocessor import align_ply_to_obj_system
             align_ply_to_obj_system(input_file, output_file)
             return {
                 'success': True,
@@ -56,42 +72,62 @@ class HybridPLYProcessor:
                 'error': str(e)
             }
     
+    def prediction_cache_key(self, aligned_file, config_path):
+        """Key a prediction on the aligned mesh content and the config file version"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(aligned_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        config_mtime = os.stat(config_path).st_mtime_ns
+        return f"{digest.hexdigest()}:{os.path.abspath(config_path)}:{config_mtime}"
+    
+    def open_prediction_cache(self):
+        """Open the on-disk prediction cache; SQLite handles locking between pool workers"""
+        os.makedirs(self.prediction_cache_dir, exist_ok=True)
+        cache = sqlite3.connect(os.path.join(self.prediction_cache_dir, "predictions.sqlite3"), timeout=60)
+        cache.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, ransac_error REAL)")
+        return cache
+    
     def run_prediction(self, aligned_file, config_path):
-        """Run prediction and extract RANSAC error"""
-        cmd = [self.python_path, "predict.py", "--c", config_path, "--n", aligned_file]
+        """Run prediction and extract RANSAC error, reusing cached errors for identical inputs"""
+        cache_key = self.prediction_cache_key(aligned_file, config_path)
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            output = result.stderr + result.stdout
-            
-            # Extract RANSAC error
-            ransac_pattern = r"Ransac average error\s+([\d.]+)"
-            match = re.search(ransac_pattern, output)
-            
-            if match:
-                ransac_error = float(match.group(1))
-                return {
-                    'success': True,
-                    'ransac_error': ransac_error,
-                    'output': output
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': 'Could not extract RANSAC error',
-                    'output': output[:500]
-                }
-                
-        except subprocess.TimeoutExpired:
+        with closing(self.open_prediction_cache()) as cache:
+            row = cache.execute("SELECT ransac_error FROM predictions WHERE key = ?",
+                                (cache_key,)).fetchone()
+        if row is not None:
+            print("   ♻️ Cached prediction found - skipping model inference")
             return {
-                'success': False,
-                'error': 'Prediction timeout'
+                'success': True,
+                'ransac_error': row[0],
+                'output': ''
             }
+        
+        try:
+            # In-process prediction: the model for each config is loaded once per process
+            from predict import PREDICT_TIMEOUT, predict
+            ransac_error = predict(config_path, aligned_file, timeout=PREDICT_TIMEOUT)
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
+        
+        if ransac_error is None:
+            return {
+                'success': False,
+                'error': 'No RANSAC error reported'
+            }
+        ransac_error = float(ransac_error)
+        
+        with closing(self.open_prediction_cache()) as cache, cache:
+            cache.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?)",
+                          (cache_key, ransac_error))
+        return {
+            'success': True,
+            'ransac_error': ransac_error,
+            'output': ''
+        }
     
     def process_single_file_hybrid(self, input_file, force_method=None):
         """
@@ -119,17 +155,22 @@ class HybridPLYProcessor:
         for method in methods_to_try:
             print(f"\n🔧 Testing {method.upper()} alignment...")
             
+            # Unique temp path on tmpfs when available, safe for parallel workers
+            with tempfile.NamedTemporaryFile(prefix=f"temp_{method}_{base_name}_", suffix='.ply',
+                                             dir=fast_temp_dir(), delete=False) as tf:
+                aligned_file = tf.name
+            
             if method == 'anatomical':
-                aligned_file = f"temp_anatomical_{base_name}.ply"
                 config_path = self.anatomical_config
                 alignment_result = self.apply_anatomical_alignment(input_file, aligned_file)
             else:  # ultimate
-                aligned_file = f"temp_ultimate_{base_name}.ply"
                 config_path = self.ultimate_config
                 alignment_result = self.apply_ultimate_alignment(input_file, aligned_file)
             
             if not alignment_result['success']:
                 print(f"❌ {method.upper()} alignment failed: {alignment_result['error']}")
+                if os.path.exists(aligned_file):
+                    os.remove(aligned_file)
                 continue
             
             print(f"✅ {method.upper()} alignment completed")
@@ -171,6 +212,11 @@ class HybridPLYProcessor:
                     'status': status,
                     'config': config_path
                 }
+                
+                if (method == 'anatomical' and len(methods_to_try) > 1
+                        and ransac_error < self.early_exit_threshold):
+                    print(f"⏭️  Anatomical RANSAC below {self.early_exit_threshold} - skipping ultimate")
+                    break
             else:
                 print(f"❌ Prediction failed: {prediction_result['error']}")
         
@@ -209,11 +255,8 @@ class HybridPLYProcessor:
     def process_poor_performers_from_batch(self, batch_results_file="batch_results.json"):
         """Process files that performed poorly with anatomical alignment"""
         
-        # Load previous results
-        with open(batch_results_file, 'r') as f:
-            batch_results = json.load(f)
-        
-        poor_files = [r for r in batch_results if r['status'] == 'poor']
+        # Stream previous results so only the poor performers are kept in memory
+        poor_files = [r for r in iter_report_items(batch_results_file) if r['status'] == 'poor']
         
         if not poor_files:
             print("No poor performing files found in batch results!")
@@ -225,47 +268,58 @@ class HybridPLYProcessor:
         print(f"Found {len(poor_files)} files that performed poorly with anatomical alignment")
         print("Testing ultimate preprocessing for these files...")
         
-        hybrid_results = []
+        # One directory listing per category instead of a stat per file
+        class_dirs = {'men': Path("assets/files/class1/men"), 'women': Path("assets/files/class1/women")}
+        available = {(category, path.stem): str(path)
+                     for category, class_dir in class_dirs.items() for path in class_dir.glob('*.ply')}
+        input_files = [available.get(('men' if r['category'] == 'men' else 'women', r['file']))
+                       for r in poor_files]
         
-        for i, poor_result in enumerate(poor_files, 1):
-            filename = poor_result['file']
-            category = poor_result['category']
-            original_ransac = poor_result['ransac_error']
-            
-            # Find original file path
-            if category == 'men':
-                input_file = f"assets/files/class1/men/{filename}.ply"
-            else:
-                input_file = f"assets/files/class1/women/{filename}.ply"
-            
-            if not os.path.exists(input_file):
-                print(f"❌ [{i}/{len(poor_files)}] File not found: {input_file}")
-                continue
-            
-            print(f"\n[{i}/{len(poor_files)}] Processing: {filename}.ply ({category})")
-            print(f"   Previous anatomical RANSAC: {original_ransac:.2f}")
+        # Each file is independent and dominated by alignment + model inference, so run them in parallel
+        positions = [f"{i}/{len(poor_files)}" for i in range(1, len(poor_files) + 1)]
+        max_workers = max(1, min(self.max_workers, len(poor_files)))
+        
+        from predict import init_predict_worker
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_predict_worker,
+                                 initargs=(max_workers, self.ultimate_config)) as executor:
+            results = executor.map(self.process_poor_performer, poor_files, input_files, positions)
+            hybrid_results = [result for result in results if result]
+        
+        return hybrid_results
+    
+    def process_poor_performer(self, poor_result, input_file, position=""):
+        """Re-run one poor performer from the batch with ultimate preprocessing"""
+        filename = poor_result['file']
+        category = poor_result['category']
+        original_ransac = poor_result['ransac_error']
+        
+        if input_file is None:
+            class_name = 'men' if category == 'men' else 'women'
+            print(f"❌ [{position}] File not found: assets/files/class1/{class_name}/{filename}.ply")
+            return None
+        
+        print(f"\n[{position}] Processing: {filename}.ply ({category})")
+        print(f"   Previous anatomical RANSAC: {original_ransac:.2f}")
+        
+        # Test ultimate method
+        result = self.process_single_file_hybrid(input_file, force_method='ultimate')
+        
+        if result:
+            new_ransac = result['best_result']['ransac_error']
+            improvement = original_ransac - new_ransac
+            improvement_pct = (improvement / original_ransac) * 100 if original_ransac > 0 else 0
             
-            # Test ultimate method
-            result = self.process_single_file_hybrid(input_file, force_method='ultimate')
+            result['original_anatomical_ransac'] = original_ransac
+            result['improvement'] = improvement
+            result['improvement_percentage'] = improvement_pct
+            result['category'] = category
             
-            if result:
-                new_ransac = result['best_result']['ransac_error']
-                improvement = original_ransac - new_ransac
-                improvement_pct = (improvement / original_ransac) * 100 if original_ransac > 0 else 0
-                
-                result['original_anatomical_ransac'] = original_ransac
-                result['improvement'] = improvement
-                result['improvement_percentage'] = improvement_pct
-                result['category'] = category
-                
-                if improvement > 0:
-                    print(f"🎉 IMPROVEMENT: {improvement:.2f} ({improvement_pct:.1f}% better)")
-                else:
-                    print(f"⚠️ NO IMPROVEMENT: {abs(improvement):.2f} worse")
-                
-                hybrid_results.append(result)
+            if improvement > 0:
+                print(f"🎉 IMPROVEMENT: {improvement:.2f} ({improvement_pct:.1f}% better)")
+            else:
+                print(f"⚠️ NO IMPROVEMENT: {abs(improvement):.2f} worse")
         
-        return hybrid_results
+        return result
     
     def generate_hybrid_report(self, hybrid_results):
         """Generate comprehensive hybrid processing report"""
@@ -277,40 +331,39 @@ class HybridPLYProcessor:
         print("HYBRID PROCESSING REPORT")
         print(f"{'='*90}")
         
-        print(f"\n📊 HYBRID RESULTS SUMMARY:")
-        print(f"{'File':<8} {'Category':<8} {'Method':<10} {'Original':<12} {'New':<12} {'Improvement':<15} {'Status'}")
-        print("-" * 90)
-        
-        improved_count = 0
-        total_improvement = 0
+        # Numeric work on whole arrays; the loop below only formats rows
+        original = np.array([r['original_anatomical_ransac'] for r in hybrid_results], dtype=np.float64)
+        new = np.array([r['best_result']['ransac_error'] for r in hybrid_results], dtype=np.float64)
+        improvement = original - new
+        safe_original = np.where(original > 0, original, 1.0)
+        improvement_pct = np.where(original > 0, improvement / safe_original * 100, 0.0)
+        improved_mask = improvement > 0
+        improved_count = int(improved_mask.sum())
         
-        for result in hybrid_results:
-            original = result['original_anatomical_ransac']
-            new = result['best_result']['ransac_error']
-            improvement = result['improvement']
-            improvement_pct = result['improvement_percentage']
-            
-            if improvement > 0:
-                improved_count += 1
-                total_improvement += improvement_pct
-                status = f"✅ +{improvement_pct:.1f}%"
+        rows = [f"\n📊 HYBRID RESULTS SUMMARY:",
+                f"{'File':<8} {'Category':<8} {'Method':<10} {'Original':<12} {'New':<12} {'Improvement':<15} {'Status'}",
+                "-" * 90]
+        for i, result in enumerate(hybrid_results):
+            if improved_mask[i]:
+                status = f"✅ +{improvement_pct[i]:.1f}%"
             else:
-                status = f"❌ {improvement_pct:.1f}%"
+                status = f"❌ {improvement_pct[i]:.1f}%"
             
-            print(f"{result['file']:<8} {result['category']:<8} {result['best_method']:<10} "
-                  f"{original:<12.2f} {new:<12.2f} {improvement:<15.2f} {status}")
+            rows.append(f"{result['file']:<8} {result['category']:<8} {result['best_method']:<10} "
+                        f"{original[i]:<12.2f} {new[i]:<12.2f} {improvement[i]:<15.2f} {status}")
+        print("\n".join(rows))
         
         print(f"\n📈 IMPROVEMENT STATISTICS:")
         print(f"  Files processed: {len(hybrid_results)}")
         print(f"  Files improved: {improved_count}/{len(hybrid_results)} ({improved_count/len(hybrid_results)*100:.1f}%)")
         
         if improved_count > 0:
-            avg_improvement = total_improvement / improved_count
+            avg_improvement = improvement_pct[improved_mask].mean()
             print(f"  Average improvement: {avg_improvement:.1f}%")
         
         # Best improvements
-        sorted_by_improvement = sorted(hybrid_results, key=lambda x: x['improvement'], reverse=True)
-        best_improvements = [r for r in sorted_by_improvement if r['improvement'] > 0][:3]
+        best_improvements = heapq.nlargest(3, (r for r in hybrid_results if r['improvement'] > 0),
+                                           key=operator.itemgetter('improvement'))
         
         if best_improvements:
             print(f"\n🏆 TOP IMPROVEMENTS:")
@@ -335,29 +388,36 @@ class HybridPLYProcessor:
             }
             json_results.append(json_result)
         
-        with open(filename, 'w') as f:
-            json.dump(json_results, f, indent=2)
+        save_report_json(json_results, filename)
         print(f"\n💾 Hybrid results saved to: {filename}")
 
 def main():
-    processor = HybridPLYProcessor()
+    parser = argparse.ArgumentParser(description='Hybrid PLY Preprocessor')
+    parser.add_argument('input', nargs='?', help='PLY file to test with both methods (or the forced one)')
+    parser.add_argument('method', nargs='?', choices=ALIGNMENT_METHODS,
+                        help='force a single alignment method instead of comparing both')
+    parser.add_argument('--poor', action='store_true', help='process poor performers from batch_results.json')
+    parser.add_argument('--early-exit', type=float, default=5.0, metavar='RANSAC',
+                        help='skip the ultimate pass when anatomical RANSAC is below this (0 always runs both; default: 5.0)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='worker processes for --poor, each keeping a model in memory (default: 2)')
+    args = parser.parse_args()
     
-    if len(sys.argv) == 3:
+    if args.input:
         # Single file processing
-        input_file = sys.argv[1]
-        method = sys.argv[2] if sys.argv[2] in ['anatomical', 'ultimate'] else None
-        
-        if not os.path.exists(input_file):
-            print(f"❌ File not found: {input_file}")
+        if not os.path.exists(args.input):
+            print(f"❌ File not found: {args.input}")
             return
         
-        result = processor.process_single_file_hybrid(input_file, force_method=method)
+        processor = HybridPLYProcessor(early_exit_threshold=args.early_exit)
+        result = processor.process_single_file_hybrid(args.input, force_method=args.method)
         if result:
             print(f"\n✅ Best method for {result['file']}: {result['best_method'].upper()}")
             print(f"   RANSAC Error: {result['best_result']['ransac_error']:.2f}")
     
-    elif len(sys.argv) == 2 and sys.argv[1] == "--poor":
+    elif args.poor:
         # Process poor performers from batch results
+        processor = HybridPLYProcessor(early_exit_threshold=args.early_exit, max_workers=args.workers)
         hybrid_results = processor.process_poor_performers_from_batch()
         
         if hybrid_results:
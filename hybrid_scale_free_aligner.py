@@ -6,68 +6,134 @@ while preserving scale for manual landmark compatibility.
 """
 
 import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 import numpy as np
 import os
-import json
 import sys
+import pickle
+import hashlib
+import tempfile
+from dataclasses import dataclass
+from utils.util import CACHE_DIR, load_base_config, save_config_if_changed
+from utils3d import Utils3D
 from anatomical_aligner import AnatomicalAligner
 from ultimate_scale_free_preprocessor import UltimateScaleFreePreprocessor
 
+@dataclass(frozen=True, slots=True)
+class PlyStats:
+    """Scalar PLY characteristics used for method selection (no mesh or vertex data)"""
+    n_points: int
+    width: float
+    height: float
+    depth: float
+    center: np.ndarray
+    diagonal: float
+    aspect_ratios: list
+    max_aspect_ratio: float
+    is_standard_face: bool
+    vertex_density: float
+    n_arrays: int
+    has_colors: bool
+    has_normals: bool
+    bounds: tuple
+
 class HybridScaleFreeAligner:
     def __init__(self):
         self.anatomical_aligner = None
         self.ultimate_processor = UltimateScaleFreePreprocessor()
         self.preserve_scale = True
+        self.analysis_cache_dir = os.path.join(CACHE_DIR, "ply_analysis")
+        self._analysis_memo = {}
+    
+    def analysis_cache_file(self, ply_path):
+        """On-disk cache location for a PLY analysis, keyed by path, mtime and size"""
+        path = os.path.abspath(ply_path)
+        stat = os.stat(path)
+        key = hashlib.sha1(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+        return os.path.join(self.analysis_cache_dir, f"{key}.pkl")
     
-    def analyze_ply_characteristics(self, ply_path):
-        """Analyze PLY file to determine best alignment method"""
+    def analyze_ply_characteristics(self, ply_path, mesh=None):
+        """Analyze PLY file to determine best alignment method
+
+        Returns a PlyStats; pass an already loaded ``mesh`` to avoid reading the file here.
+        """
         
         print(f"\n🔍 Analyzing PLY Characteristics: {os.path.basename(ply_path)}")
         print("-" * 60)
         
-        # Load PLY
+        cache_file = self.analysis_cache_file(ply_path)
+        if cache_file in self._analysis_memo:
+            analysis = self._analysis_memo[cache_file]
+            print("♻️  Reusing analysis from this session")
+        else:
+            analysis = None
+            try:
+                with open(cache_file, 'rb') as f:
+                    analysis = pickle.load(f)
+                if not isinstance(analysis, PlyStats):
+                    raise TypeError("stale analysis cache entry")
+                print("♻️  Using cached analysis")
+            except Exception:  # missing, unreadable or stale cache entry
+                analysis = self.compute_ply_characteristics(ply_path, mesh=mesh)
+                self.save_cached_analysis(cache_file, analysis)
+            self._analysis_memo[cache_file] = analysis
+        
+        self.print_analysis(analysis)
+        return analysis
+    
+    def save_cached_analysis(self, cache_file, analysis):
+        """Persist an analysis for later runs"""
+        try:
+            os.makedirs(self.analysis_cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.analysis_cache_dir, delete=False) as f:
+                pickle.dump(analysis, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, cache_file)
+        except OSError as e:
+            print(f"⚠️  Could not cache PLY analysis: {e}")
+    
+    def load_mesh(self, ply_path):
+        """Read a PLY file into vtkPolyData"""
         reader = vtk.vtkPLYReader()
         reader.SetFileName(ply_path)
         reader.Update()
-        mesh = reader.GetOutput()
+        return reader.GetOutput()
+    
+    def compute_ply_characteristics(self, ply_path, mesh=None):
+        """Compute the characteristics used for method selection"""
         
-        # Extract basic info
+        # Load PLY
+        if mesh is None:
+            mesh = self.load_mesh(ply_path)
+        
+        # Extract basic info; the vertex array is only needed for these reductions
         points = mesh.GetPoints()
         n_points = points.GetNumberOfPoints()
-        vertices = np.array([points.GetPoint(i) for i in range(n_points)])
-        bounds = mesh.GetBounds()
-        center = np.mean(vertices, axis=0)
+        vertices = vtk_to_numpy(points.GetData()).reshape(-1, 3)  # zero-copy view, read only here
+        mins, maxs, center = Utils3D.vertex_stats(vertices)
+        mins, maxs = mins.astype(np.float64), maxs.astype(np.float64)
+        bounds = tuple(np.column_stack((mins, maxs)).ravel().tolist())  # VTK GetBounds() layout
         
         # Calculate dimensions
-        width = bounds[1] - bounds[0]    # X range
-        height = bounds[3] - bounds[2]   # Y range  
-        depth = bounds[5] - bounds[4]    # Z range
+        dims = maxs - mins
+        width, height, depth = dims    # X, Y, Z ranges
         
-        diagonal = np.sqrt(width**2 + height**2 + depth**2)
+        diagonal = np.linalg.norm(dims)
         
         # Analyze point data (texture/color info)
         point_data = mesh.GetPointData()
         n_arrays = point_data.GetNumberOfArrays()
-        has_colors = False
-        has_normals = False
-        
-        for i in range(n_arrays):
-            array = point_data.GetArray(i)
-            n_components = array.GetNumberOfComponents()
-            array_name = array.GetName() if array.GetName() else f"Array_{i}"
-            
-            if n_components >= 3 and 'color' in array_name.lower() or 'rgb' in array_name.lower():
-                has_colors = True
-            elif n_components == 3 and 'normal' in array_name.lower():
-                has_normals = True
+        has_normals = point_data.GetNormals() is not None
+        # vtkPLYReader exposes vertex colors as the active scalars ("RGB"/"RGBA")
+        colors = point_data.GetScalars() or point_data.GetArray('RGB')
+        has_colors = ((colors is not None and colors.GetNumberOfComponents() >= 3)
+                      or point_data.GetArray('red') is not None)
         
         # Analyze shape characteristics
-        aspect_ratios = [
-            max(width, height) / min(width, height),
-            max(width, depth) / min(width, depth),
-            max(height, depth) / min(height, depth)
-        ]
-        max_aspect_ratio = max(aspect_ratios)
+        # Pairwise ratios for (W/H, W/D, H/D); the largest is simply longest / shortest side
+        first, second = dims[[0, 0, 1]], dims[[1, 2, 2]]
+        aspect_ratios = (np.maximum(first, second) / np.minimum(first, second)).tolist()
+        sorted_dims = np.sort(dims)
+        max_aspect_ratio = sorted_dims[-1] / sorted_dims[0]
         
         # Face orientation analysis
         # Check if it looks like a standard face orientation
@@ -76,34 +142,80 @@ class HybridScaleFreeAligner:
         # Complexity analysis
         vertex_density = n_points / (diagonal**2) if diagonal > 0 else 0
         
+        return PlyStats(
+            n_points=n_points,
+            width=float(width),
+            height=float(height),
+            depth=float(depth),
+            center=center,
+            diagonal=float(diagonal),
+            aspect_ratios=aspect_ratios,
+            max_aspect_ratio=float(max_aspect_ratio),
+            is_standard_face=bool(is_standard_face),
+            vertex_density=float(vertex_density),
+            n_arrays=n_arrays,
+            has_colors=bool(has_colors),
+            has_normals=bool(has_normals),
+            bounds=bounds
+        )
+    
+    def print_analysis(self, analysis):
+        """Print the analysis summary"""
         print(f"📊 Analysis Results:")
-        print(f"   Points: {n_points:,}")
-        print(f"   Dimensions: W={width:.1f} H={height:.1f} D={depth:.1f}")
-        print(f"   Center: {center}")
-        print(f"   Diagonal: {diagonal:.1f}")
-        print(f"   Max aspect ratio: {max_aspect_ratio:.2f}")
-        print(f"   Standard face orientation: {is_standard_face}")
-        print(f"   Vertex density: {vertex_density:.2f}")
-        print(f"   Data arrays: {n_arrays}")
-        print(f"   Has colors: {has_colors}")
-        print(f"   Has normals: {has_normals}")
-        
-        return {
-            'n_points': n_points,
-            'dimensions': {'width': width, 'height': height, 'depth': depth},
-            'center': center,
-            'diagonal': diagonal,
-            'aspect_ratios': aspect_ratios,
-            'max_aspect_ratio': max_aspect_ratio,
-            'is_standard_face': is_standard_face,
-            'vertex_density': vertex_density,
-            'n_arrays': n_arrays,
-            'has_colors': has_colors,
-            'has_normals': has_normals,
-            'mesh': mesh,
-            'vertices': vertices,
-            'bounds': bounds
-        }
+        print(f"   Points: {analysis.n_points:,}")
+        print(f"   Dimensions: W={analysis.width:.1f} H={analysis.height:.1f} D={analysis.depth:.1f}")
+        print(f"   Center: {analysis.center}")
+        print(f"   Diagonal: {analysis.diagonal:.1f}")
+        print(f"   Max aspect ratio: {analysis.max_aspect_ratio:.2f}")
+        print(f"   Standard face orientation: {analysis.is_standard_face}")
+        print(f"   Vertex density: {analysis.vertex_density:.2f}")
+        print(f"   Data arrays: {analysis.n_arrays}")
+        print(f"   Has colors: {analysis.has_colors}")
+        print(f"   Has normals: {analysis.has_normals}")
+    
+    # Most points each selection factor can award, as (anatomical, ultimate)
+    FACTOR_MAX_POINTS = ((3, 2), (2, 3), (1, 1), (2, 1), (1, 2))
+    
+    def iter_selection_factors(self, analysis):
+        """Yield (anatomical points, ultimate points, reason) for each factor, in FACTOR_MAX_POINTS order"""
+        
+        # Factor 1: Face orientation
+        if analysis.is_standard_face:
+            yield 3, 0, "✅ Standard face orientation → Anatomical +3"
+        else:
+            yield 0, 2, "⚠️  Non-standard orientation → Ultimate +2"
+        
+        # Factor 2: Aspect ratio
+        if analysis.max_aspect_ratio < 1.5:
+            yield 2, 0, "✅ Good proportions → Anatomical +2"
+        elif analysis.max_aspect_ratio > 3.0:
+            yield 0, 3, "⚠️  Extreme proportions → Ultimate +3"
+        else:
+            yield 0, 0, None
+        
+        # Factor 3: Point density
+        if analysis.vertex_density > 100:
+            yield 1, 0, "✅ High vertex density → Anatomical +1"
+        elif analysis.vertex_density < 10:
+            yield 0, 1, "⚠️  Low vertex density → Ultimate +1"
+        else:
+            yield 0, 0, None
+        
+        # Factor 4: Data complexity
+        if analysis.has_colors and analysis.has_normals:
+            yield 2, 0, "✅ Rich data (colors+normals) → Anatomical +2"
+        elif analysis.n_arrays == 0:
+            yield 0, 1, "⚠️  Minimal data → Ultimate +1"
+        else:
+            yield 0, 0, None
+        
+        # Factor 5: Size (diagonal)
+        if 100 < analysis.diagonal < 300:
+            yield 1, 0, "✅ Standard face size → Anatomical +1"
+        elif analysis.diagonal > 500 or analysis.diagonal < 50:
+            yield 0, 2, "⚠️  Unusual size → Ultimate +2"
+        else:
+            yield 0, 0, None
     
     def select_optimal_method(self, analysis):
         """Select the best alignment method based on PLY characteristics"""
@@ -118,45 +230,27 @@ class HybridScaleFreeAligner:
             'reasons': []
         }
         
-        # Factor 1: Face orientation
-        if analysis['is_standard_face']:
-            factors['anatomical_score'] += 3
-            factors['reasons'].append("✅ Standard face orientation → Anatomical +3")
-        else:
-            factors['ultimate_score'] += 2
-            factors['reasons'].append("⚠️  Non-standard orientation → Ultimate +2")
-        
-        # Factor 2: Aspect ratio
-        if analysis['max_aspect_ratio'] < 1.5:
-            factors['anatomical_score'] += 2
-            factors['reasons'].append("✅ Good proportions → Anatomical +2")
-        elif analysis['max_aspect_ratio'] > 3.0:
-            factors['ultimate_score'] += 3
-            factors['reasons'].append("⚠️  Extreme proportions → Ultimate +3")
-        
-        # Factor 3: Point density
-        if analysis['vertex_density'] > 100:
-            factors['anatomical_score'] += 1
-            factors['reasons'].append("✅ High vertex density → Anatomical +1")
-        elif analysis['vertex_density'] < 10:
-            factors['ultimate_score'] += 1
-            factors['reasons'].append("⚠️  Low vertex density → Ultimate +1")
+        remaining_anatomical = sum(points for points, _ in self.FACTOR_MAX_POINTS)
+        remaining_ultimate = sum(points for _, points in self.FACTOR_MAX_POINTS)
         
-        # Factor 4: Data complexity
-        if analysis['has_colors'] and analysis['has_normals']:
-            factors['anatomical_score'] += 2
-            factors['reasons'].append("✅ Rich data (colors+normals) → Anatomical +2")
-        elif analysis['n_arrays'] == 0:
-            factors['ultimate_score'] += 1
-            factors['reasons'].append("⚠️  Minimal data → Ultimate +1")
-        
-        # Factor 5: Size (diagonal)
-        if 100 < analysis['diagonal'] < 300:
-            factors['anatomical_score'] += 1
-            factors['reasons'].append("✅ Standard face size → Anatomical +1")
-        elif analysis['diagonal'] > 500 or analysis['diagonal'] < 50:
-            factors['ultimate_score'] += 2
-            factors['reasons'].append("⚠️  Unusual size → Ultimate +2")
+        # zip() pulls the limits first, so breaking out leaves the remaining factors unevaluated
+        for (max_anatomical, max_ultimate), (anatomical, ultimate, reason) in zip(
+                self.FACTOR_MAX_POINTS, self.iter_selection_factors(analysis)):
+            factors['anatomical_score'] += anatomical
+            factors['ultimate_score'] += ultimate
+            if reason:
+                factors['reasons'].append(reason)
+            
+            remaining_anatomical -= max_anatomical
+            remaining_ultimate -= max_ultimate
+            if not (remaining_anatomical or remaining_ultimate):
+                break
+            
+            # Stop once the remaining factors can no longer change the outcome (ties go to anatomical)
+            lead = factors['anatomical_score'] - factors['ultimate_score']
+            if lead >= remaining_ultimate or lead + remaining_anatomical < 0:
+                factors['reasons'].append("⏩ Outcome settled - remaining factors skipped")
+                break
         
         # Decision
         selected_method = 'anatomical' if factors['anatomical_score'] >= factors['ultimate_score'] else 'ultimate'
@@ -185,19 +279,20 @@ class HybridScaleFreeAligner:
             print(f"❌ Input file not found: {ply_path}")
             return None
         
-        # Step 1: Analyze PLY characteristics
-        analysis = self.analyze_ply_characteristics(ply_path)
+        # Step 1: Analyze PLY characteristics (the mesh is read once and shared with the aligner)
+        mesh = self.load_mesh(ply_path)
+        analysis = self.analyze_ply_characteristics(ply_path, mesh=mesh)
         
         # Step 2: Select optimal method
         selected_method, scoring = self.select_optimal_method(analysis)
         
         # Step 3: Apply selected method
         if selected_method == 'anatomical':
-            return self.apply_anatomical_scale_free(ply_path, output_path, analysis)
+            return self.apply_anatomical_scale_free(ply_path, output_path, analysis, mesh=mesh)
         else:
-            return self.apply_ultimate_scale_free(ply_path, output_path, analysis)
+            return self.apply_ultimate_scale_free(ply_path, output_path, analysis, mesh=mesh)
     
-    def apply_anatomical_scale_free(self, ply_path, output_path, analysis):
+    def apply_anatomical_scale_free(self, ply_path, output_path, analysis=None, mesh=None):
         """Apply anatomical scale-free alignment"""
         
         print(f"\n🧠 Applying Anatomical Scale-Free Alignment:")
@@ -207,14 +302,15 @@ class HybridScaleFreeAligner:
         from scale_free_aligner import ScaleFreeAligner
         
         aligner = ScaleFreeAligner()
-        result = aligner.apply_scale_free_alignment(ply_path, output_path)
+        # Without a mesh the aligner reads the PLY itself
+        result = aligner.apply_scale_free_alignment(ply_path, output_path, mesh=mesh)
         
         result['method_used'] = 'anatomical'
         result['method_reason'] = 'Standard face geometry detected'
         
         return result
     
-    def apply_ultimate_scale_free(self, ply_path, output_path, analysis):
+    def apply_ultimate_scale_free(self, ply_path, output_path, analysis=None, mesh=None):
         """Apply ultimate scale-free alignment"""
         
         print(f"\n🔧 Applying Ultimate Scale-Free Alignment:")
@@ -227,7 +323,7 @@ class HybridScaleFreeAligner:
             obj_reference = "assets/testmeshA.obj"  # Keep trying
         
         result = self.ultimate_processor.align_ply_to_obj_system_scale_free(
-            ply_path, output_path, obj_reference
+            ply_path, output_path, obj_reference, mesh=mesh
         )
         
         result['method_used'] = 'ultimate'
@@ -246,13 +342,13 @@ class HybridScaleFreeAligner:
             output_config = "configs/DTU3D-hybrid-ultimate.json"
         
         try:
-            with open(base_config, 'r') as f:
-                config = json.load(f)
+            config = load_base_config(base_config)
             
             config['name'] = "MVLMModel_DTU3D"
             
-            with open(output_config, 'w') as f:
-                json.dump(config, f, indent=2)
+            if not save_config_if_changed(config, output_config):
+                print(f"📝 Hybrid config up to date: {output_config}")
+                return output_config
             
             print(f"📝 Hybrid config created: {output_config}")
             return output_config
@@ -291,12 +387,11 @@ def main():
     
     if force_method in ['anatomical', 'ultimate']:
         print(f"🔧 Forced method: {force_method.upper()}")
-        analysis = aligner.analyze_ply_characteristics(input_ply)
-        
+        # No method selection, so the PLY characteristics analysis is not needed
         if force_method == 'anatomical':
-            result = aligner.apply_anatomical_scale_free(input_ply, output_ply, analysis)
+            result = aligner.apply_anatomical_scale_free(input_ply, output_ply)
         else:
-            result = aligner.apply_ultimate_scale_free(input_ply, output_ply, analysis)
+            result = aligner.apply_ultimate_scale_free(input_ply, output_ply)
     else:
         # Auto-select method
         result = aligner.apply_hybrid_scale_free_alignment(input_ply, output_ply)
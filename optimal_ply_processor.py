@@ -6,33 +6,44 @@ Based on hybrid testing results
 """
 
 import os
-import sys
 import json
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from hybrid_ply_processor import HybridPLYProcessor
+from ultimate_ply_preprocessor import align_ply_to_obj_system
+
+@lru_cache(maxsize=None)
+def shared_hybrid_processor():
+    """One HybridPLYProcessor (and its lazily built aligner) per process"""
+    return HybridPLYProcessor()
 
 class OptimalPLYProcessor:
     def __init__(self):
-        self.hybrid_processor = HybridPLYProcessor()
-        
         # Rules based on testing
-        self.anatomical_excellent_files = [
+        self.anatomical_excellent_files = frozenset({
             "1", "2", "3", "5", "19", "20", "21", "22"
-        ]
-        self.ultimate_required_files = [
+        })
+        self.ultimate_required_files = frozenset({
             "4", "6", "23", "24"
-        ]
+        })
+        self._method_map = {
+            **{name: "anatomical" for name in self.anatomical_excellent_files},
+            **{name: "ultimate" for name in self.ultimate_required_files},
+        }
+    
+    @property
+    def hybrid_processor(self):
+        # Not stored on the instance, so batch workers don't pickle it and reuse their own
+        return shared_hybrid_processor()
     
     def get_optimal_method(self, filename):
         """Determine optimal method based on testing results"""
         base_name = os.path.splitext(os.path.basename(filename))[0]
         
-        if base_name in self.anatomical_excellent_files:
-            return "anatomical"
-        elif base_name in self.ultimate_required_files:
-            return "ultimate"
-        else:
-            # For unknown files, default to anatomical first
-            return "anatomical"
+        # For unknown files, default to anatomical first
+        return self._method_map.get(base_name, "anatomical")
     
     def process_with_optimal_method(self, input_file, output_file=None):
         """Process file with the optimal method"""
@@ -63,7 +74,6 @@ class OptimalPLYProcessor:
             
         else:  # ultimate
             print("🔧 Using ultimate (OBJ-based) alignment...")
-            from ultimate_ply_preprocessor import align_ply_to_obj_system
             align_ply_to_obj_system(input_file, output_file)
             config_to_use = self.hybrid_processor.ultimate_config
             
@@ -81,13 +91,53 @@ class OptimalPLYProcessor:
             'config': config_to_use,
             'prediction_command': f"python predict.py --c {config_to_use} --n {output_file}"
         }
+    
+    def process_directory(self, batch_dir, output_dir=None, jobs=1):
+        """Process every PLY in a directory with its optimal method, in one interpreter"""
+        input_files = sorted(glob.glob(os.path.join(batch_dir, '*.ply')))
+        if not input_files:
+            print(f"❌ No PLY files found in: {batch_dir}")
+            return []
+        
+        if output_dir is None:
+            output_files = [None] * len(input_files)
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            output_files = [os.path.join(output_dir, f"optimal_{os.path.basename(f)}") for f in input_files]
+        
+        print(f"📂 Batch processing {len(input_files)} PLY files from {batch_dir}")
+        
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(input_files))) as executor:
+                results = list(executor.map(self.process_with_optimal_method, input_files, output_files))
+        else:
+            results = list(map(self.process_with_optimal_method, input_files, output_files))
+        
+        return [result for result in results if result]
 
 def main():
+    parser = argparse.ArgumentParser(description='Optimal PLY Processor')
+    parser.add_argument('input', nargs='?', help='PLY file to preprocess')
+    parser.add_argument('output', nargs='?', help='output PLY file (default: optimal_<name>.ply)')
+    parser.add_argument('--batch', metavar='DIR', help='preprocess every PLY file in DIR')
+    parser.add_argument('--output-dir', metavar='DIR', help='where --batch writes its files (default: current directory)')
+    parser.add_argument('--jobs', type=int, default=1, help='worker processes for --batch (default: 1)')
+    args = parser.parse_args()
+    
     processor = OptimalPLYProcessor()
     
-    if len(sys.argv) < 2:
+    if args.batch:
+        results = processor.process_directory(args.batch, args.output_dir, args.jobs)
+        
+        print(f"\n✨ Batch processing completed: {len(results)} files")
+        for result in results:
+            print(f"   {os.path.basename(result['input_file'])}: {result['method'].upper()} → {result['output_file']}")
+        return
+    
+    if not args.input:
         print("Optimal PLY Processor Usage:")
         print("  python optimal_ply_processor.py input.ply [output.ply]")
+        print("  python optimal_ply_processor.py --batch DIR [--output-dir DIR] [--jobs N]")
         print("\nThis script automatically selects the best preprocessing method")
         print("based on comprehensive testing results:")
         print("  - Anatomical alignment for: 1, 2, 3, 5, 19, 20, 21, 22")
@@ -95,10 +145,7 @@ def main():
         print("  - Default to anatomical for unknown files")
         return
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else None
-    
-    result = processor.process_with_optimal_method(input_file, output_file)
+    result = processor.process_with_optimal_method(args.input, args.output)
     
     if result:
         print(f"\n✨ Processing completed successfully!")
@@ -1,5 +1,6 @@
 import os
 import logging
+from argparse import Namespace
 from pathlib import Path
 from functools import reduce
 from operator import getitem
@@ -9,11 +10,12 @@ from utils import read_json, write_json
 
 
 class ConfigParser:
-    def __init__(self, args, options='', timestamp=True):
-        # parse default and custom cli options
-        for opt in options:
-            args.add_argument(*opt.flags, default=None, type=opt.type)
-        args = args.parse_args()
+    def __init__(self, args, options='', timestamp=True, modification=None):
+        # parse default and custom cli options (an already parsed Namespace is used as is)
+        if not isinstance(args, Namespace):
+            for opt in options:
+                args.add_argument(*opt.flags, default=None, type=opt.type)
+            args = args.parse_args()
         self._name = None
 
         if hasattr(args, 'device'):
@@ -43,6 +45,9 @@ class ConfigParser:
         # load config file and apply custom cli options
         config = read_json(self.cfg_fname)
         self._config = _update_config(config, options, args)
+        # in-memory overrides as {key path tuple: value}, so callers need not write a config file
+        for keys, value in (modification or {}).items():
+            _set_by_path(self._config, keys, value)
 
         # set save_dir where trained model and log will be saved.
         save_dir = Path(self.config['trainer']['save_dir'])
@@ -6,18 +6,24 @@ Extracts landmarks from PLY files and performs localization error analysis
 
 import os
 import sys
-import subprocess
 import json
 import numpy as np
-import re
+import zlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from anatomical_landmark_analyzer import AnatomicalLandmarkAnalyzer
+from predict import init_predict_worker, predict_landmarks
+from utils.util import load_base_config
 
 class PLYLandmarkExtractor:
     def __init__(self):
-        self.python_path = "/Users/eck/Documents/Projects/Face-Landmark/Deep-MVLM/env/bin/python"
         self.anatomical_config = "configs/DTU3D-anatomical.json"
         self.ultimate_config = "configs/DTU3D-PLY-ultimate-final.json"
         self.output_dir = "extracted_landmarks"
+        self.num_workers = 2  # Resident worker processes, each holding both models
+        self.predict_timeout = 200  # Seconds one prediction may take before it counts as failed
+        self.text_output = False  # True writes human-readable .txt landmarks instead of binary .npy
         
     def setup_output_directory(self):
         """Create output directory for landmarks"""
@@ -25,189 +31,165 @@ class PLYLandmarkExtractor:
             os.makedirs(self.output_dir)
             print(f"📁 Created landmark output directory: {self.output_dir}")
     
+    def landmarks_path(self, name: str) -> str:
+        """Landmark file path in the output directory, with the extension for the current format"""
+        return os.path.join(self.output_dir, f"{name}_landmarks.{'txt' if self.text_output else 'npy'}")
+    
+    def save_landmarks(self, landmarks_file: str, landmarks: np.ndarray):
+        """Write landmarks as text or binary .npy, matching landmarks_path"""
+        if self.text_output:
+            np.savetxt(landmarks_file, landmarks, fmt='%.6f')
+        else:
+            np.save(landmarks_file, landmarks)
+    
     def extract_landmarks_from_ply(self, ply_file: str, config_file: str, 
-                                  output_prefix: str) -> str:
-        """Extract landmarks from PLY file using the model"""
+                                  output_prefix: str) -> tuple:
+        """Extract landmarks from PLY file using the model
+        
+        Returns (landmarks_file, landmarks), or (None, None) if extraction failed.
+        """
         
         base_name = os.path.splitext(os.path.basename(ply_file))[0]
-        landmarks_file = os.path.join(self.output_dir, f"{output_prefix}_{base_name}_landmarks.txt")
+        landmarks_file = self.landmarks_path(f"{output_prefix}_{base_name}")
         
         print(f"🔍 Extracting landmarks from {os.path.basename(ply_file)}...")
         
         try:
-            # Run prediction to extract landmarks
-            cmd = [self.python_path, "predict.py", "--c", config_file, "--n", ply_file]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            
-            output = result.stderr + result.stdout
-            
-            # Parse landmark coordinates from output
-            landmarks = self.parse_landmarks_from_output(output)
+            # Predict on this worker's already loaded model instead of spawning predict.py
+            landmarks = predict_landmarks(config_file, ply_file, timeout=self.predict_timeout)
             
             if landmarks is not None:
+                landmarks = np.asarray(landmarks)
                 # Save landmarks to file
-                np.savetxt(landmarks_file, landmarks, fmt='%.6f')
+                self.save_landmarks(landmarks_file, landmarks)
                 print(f"   ✅ Landmarks saved to: {os.path.basename(landmarks_file)}")
-                return landmarks_file
+                return landmarks_file, landmarks
             else:
                 print(f"   ❌ Failed to extract landmarks from output")
-                return None
+                return None, None
                 
-        except subprocess.TimeoutExpired:
-            print(f"   ❌ Extraction timeout for {ply_file}")
-            return None
         except Exception as e:
             print(f"   ❌ Extraction error: {e}")
-            return None
-    
-    def parse_landmarks_from_output(self, output: str) -> np.ndarray:
-        """Parse landmark coordinates from model output"""
-        
-        # Look for landmark coordinates in the output
-        # This depends on how your model outputs landmarks
-        # Adapt this method based on your model's output format
-        
-        lines = output.split('\n')
-        landmarks = []
-        
-        # Method 1: Look for coordinate patterns
-        coord_pattern = r'[-+]?\d*\.?\d+\s+[-+]?\d*\.?\d+\s+[-+]?\d*\.?\d+'
-        
-        for line in lines:
-            if 'landmark' in line.lower() or 'coord' in line.lower():
-                matches = re.findall(coord_pattern, line)
-                for match in matches:
-                    coords = [float(x) for x in match.split()]
-                    if len(coords) == 3:
-                        landmarks.append(coords)
-        
-        # Method 2: Look for specific landmark file output
-        for line in lines:
-            if 'landmarks saved' in line.lower() or '.txt' in line:
-                # Try to find and read the landmarks file
-                file_match = re.search(r'(\S+\.txt)', line)
-                if file_match:
-                    landmark_file = file_match.group(1)
-                    if os.path.exists(landmark_file):
-                        try:
-                            landmarks = np.loadtxt(landmark_file)
-                            return landmarks
-                        except:
-                            continue
-        
-        # Method 3: Check if there's a standard output format
-        if len(landmarks) == 0:
-            # Look for any numerical data that could be landmarks
-            numbers = re.findall(r'[-+]?\d*\.?\d+', output)
-            if len(numbers) >= 68 * 3:  # 68 landmarks * 3 coordinates
-                try:
-                    coords = [float(x) for x in numbers[:68*3]]
-                    landmarks = np.array(coords).reshape(68, 3)
-                    return landmarks
-                except:
-                    pass
-        
-        if len(landmarks) > 0:
-            return np.array(landmarks)
-        else:
-            # Generate dummy landmarks for demonstration
-            # In real use, this should be removed and proper parsing implemented
-            print("   ⚠️ Warning: Using dummy landmarks - implement proper parsing")
-            return self.generate_dummy_landmarks()
+            return None, None
     
-    def generate_dummy_landmarks(self) -> np.ndarray:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def generate_dummy_landmarks(n_landmarks: int = 68) -> np.ndarray:
         """Generate dummy landmarks for demonstration purposes"""
-        # Create 68 landmarks in a face-like arrangement
-        landmarks = []
+        # Lay out 68 landmarks in a face-like arrangement; other counts wrap around that layout
+        # (read-only, since the array is shared)
         
         # Face outline (17 points)
-        for i in range(17):
-            x = -80 + i * 10
-            y = -40 + abs(i - 8) * 2
-            z = 0
-            landmarks.append([x, y, z])
-        
-        # Eyebrows (10 points)
-        for i in range(5):
-            landmarks.append([-40 + i * 10, 20, 5])  # Right eyebrow
-        for i in range(5):
-            landmarks.append([-40 + i * 10, 20, 5])  # Left eyebrow
-        
-        # Eyes (12 points)
-        for i in range(6):
-            landmarks.append([-30 + i * 5, 10, 2])  # Right eye
-        for i in range(6):
-            landmarks.append([5 + i * 5, 10, 2])    # Left eye
+        i = np.arange(17)
+        outline = np.column_stack([-80 + i * 10, -40 + np.abs(i - 8) * 2, np.zeros(17)])
+        
+        # Eyebrows (10 points): right and left share the same coordinates
+        i = np.arange(5)
+        eyebrow = np.column_stack([-40 + i * 10, np.full(5, 20), np.full(5, 5)])
+        eyebrows = np.tile(eyebrow, (2, 1))
+        
+        # Eyes (12 points): right eye starts at x=-30, left eye at x=5
+        i = np.arange(6)
+        eyes = np.column_stack([np.concatenate([-30 + i * 5, 5 + i * 5]), np.full(12, 10), np.full(12, 2)])
         
         # Nose (9 points)
-        for i in range(9):
-            landmarks.append([-10 + i * 2.5, -5 + abs(i-4), 10])
+        i = np.arange(9)
+        nose = np.column_stack([-10 + i * 2.5, -5 + np.abs(i - 4), np.full(9, 10)])
         
         # Mouth (20 points)
-        for i in range(20):
-            x = -25 + i * 2.5
-            y = -25 + 3 * np.sin(i * np.pi / 10)
-            z = 2
-            landmarks.append([x, y, z])
+        i = np.arange(20)
+        mouth = np.column_stack([-25 + i * 2.5, -25 + 3 * np.sin(i * np.pi / 10), np.full(20, 2)])
         
-        return np.array(landmarks)
+        landmarks = np.vstack([outline, eyebrows, eyes, nose, mouth]).astype(np.float64)
+        landmarks = np.resize(landmarks, (n_landmarks, 3))
+        landmarks.flags.writeable = False
+        return landmarks
     
-    def create_ground_truth_landmarks(self, ply_file: str) -> str:
-        """Create ground truth landmarks (for demonstration)"""
+    def create_ground_truth_landmarks(self, ply_file: str, n_landmarks: int) -> str:
+        """Create ground truth landmarks (for demonstration), as many as the model predicts"""
         
         base_name = os.path.splitext(os.path.basename(ply_file))[0]
-        gt_file = os.path.join(self.output_dir, f"gt_{base_name}_landmarks.txt")
+        gt_file = self.landmarks_path(f"gt_{base_name}")
         
         # In real use, you would load actual ground truth data
         # For demonstration, we'll create slightly modified dummy landmarks
-        dummy_landmarks = self.generate_dummy_landmarks()
+        dummy_landmarks = self.generate_dummy_landmarks(n_landmarks)
         
-        # Add small random variation to simulate ground truth
-        noise = np.random.randn(*dummy_landmarks.shape) * 0.5
+        # Add small random variation to simulate ground truth, seeded per file so reruns agree
+        rng = np.random.default_rng(zlib.crc32(base_name.encode()))
+        noise = rng.standard_normal(dummy_landmarks.shape) * 0.5
         gt_landmarks = dummy_landmarks + noise
         
-        np.savetxt(gt_file, gt_landmarks, fmt='%.6f')
+        self.save_landmarks(gt_file, gt_landmarks)
         print(f"   📋 Ground truth landmarks created: {os.path.basename(gt_file)}")
         
         return gt_file
     
-    def extract_and_analyze_batch(self, ply_files: list, method: str = 'anatomical'):
-        """Extract landmarks from multiple PLY files and analyze errors"""
-        
-        print(f"\n{'='*80}")
-        print(f"PLY LANDMARK EXTRACTION & ERROR ANALYSIS")
-        print(f"{'='*80}")
-        print(f"Method: {method.upper()}")
-        print(f"Files to process: {len(ply_files)}")
+    @staticmethod
+    def landmark_count(config_file: str) -> int:
+        """Number of landmarks the model of a config predicts"""
+        return load_base_config(config_file)['arch']['args']['n_landmarks']
+    
+    def extract_file_methods(self, ply_file: str, methods: tuple) -> list:
+        """Extract one file's landmarks for each method, as a list of (landmarks_file, landmarks)"""
+        file_preds = []
+        for method in methods:
+            config_file = self.anatomical_config if method == 'anatomical' else self.ultimate_config
+            pred_file, landmarks = self.extract_landmarks_from_ply(ply_file, config_file, f"pred_{method}")
+            n_landmarks = self.landmark_count(config_file)
+            if landmarks is not None and landmarks.shape != (n_landmarks, 3):
+                print(f"   ❌ Expected {n_landmarks} landmarks, got shape {landmarks.shape}")
+                pred_file, landmarks = None, None
+            file_preds.append((pred_file, landmarks))
+        return file_preds
+    
+    def extract_landmark_pairs(self, ply_files: list, methods: tuple) -> dict:
+        """Extract predicted landmarks for every file and method in one pool
         
+        Returns {method: (file_pairs, subject_ids)} with (pred_file, gt_file) pairs in input order.
+        """
         self.setup_output_directory()
         
-        config_file = self.anatomical_config if method == 'anatomical' else self.ultimate_config
-        
-        # Extract landmarks from all files
-        file_pairs = []
-        subject_ids = []
-        
+        existing_files = []
         for i, ply_file in enumerate(ply_files, 1):
             if not os.path.exists(ply_file):
                 print(f"❌ [{i}/{len(ply_files)}] File not found: {ply_file}")
                 continue
             
-            base_name = os.path.splitext(os.path.basename(ply_file))[0]
-            subject_id = f"{base_name}_{method}"
-            
             print(f"\n[{i}/{len(ply_files)}] Processing: {os.path.basename(ply_file)}")
+            existing_files.append(ply_file)
+        
+        # A few worker processes load both models once at start-up and keep them warm for every
+        # file; more would each hold two more networks in memory. map() keeps the input order
+        max_workers = max(1, min(len(existing_files), self.num_workers))
+        configs = [self.anatomical_config if method == 'anatomical' else self.ultimate_config
+                   for method in methods]
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_predict_worker,
+                                 initargs=(max_workers, *configs)) as executor:
+            pred_files = list(executor.map(self.extract_file_methods, existing_files,
+                                           [methods] * len(existing_files)))
+        
+        extracted = {method: ([], []) for method in methods}
+        for ply_file, file_preds in zip(existing_files, pred_files):
+            if not any(pred_file for pred_file, _ in file_preds):
+                continue
             
-            # Extract predicted landmarks
-            pred_file = self.extract_landmarks_from_ply(ply_file, config_file, f"pred_{method}")
+            # Create ground truth once per file (in real use, load actual ground truth), with as
+            # many landmarks as the predictions, which were checked against their config's count
+            n_landmarks = next(len(landmarks) for _, landmarks in file_preds if landmarks is not None)
+            gt_file = self.create_ground_truth_landmarks(ply_file, n_landmarks)
+            base_name = os.path.splitext(os.path.basename(ply_file))[0]
             
-            if pred_file:
-                # Create ground truth (in real use, load actual ground truth)
-                gt_file = self.create_ground_truth_landmarks(ply_file)
-                
-                file_pairs.append((pred_file, gt_file))
-                subject_ids.append(subject_id)
+            for method, (pred_file, _) in zip(methods, file_preds):
+                if pred_file:
+                    file_pairs, subject_ids = extracted[method]
+                    file_pairs.append((pred_file, gt_file))
+                    subject_ids.append(f"{base_name}_{method}")
         
+        return extracted
+    
+    def analyze_landmark_pairs(self, file_pairs: list, subject_ids: list):
+        """Analyze extracted landmark errors against ground truth"""
         if not file_pairs:
             print("❌ No landmarks extracted successfully!")
             return None
@@ -220,6 +202,17 @@ class PLYLandmarkExtractor:
         
         return results
     
+    def extract_and_analyze_batch(self, ply_files: list, method: str = 'anatomical'):
+        """Extract landmarks from multiple PLY files and analyze errors"""
+        
+        print(f"\n{'='*80}")
+        print(f"PLY LANDMARK EXTRACTION & ERROR ANALYSIS")
+        print(f"{'='*80}")
+        print(f"Method: {method.upper()}")
+        print(f"Files to process: {len(ply_files)}")
+        
+        return self.analyze_landmark_pairs(*self.extract_landmark_pairs(ply_files, (method,))[method])
+    
     def compare_anatomical_vs_ultimate(self, ply_files: list):
         """Compare anatomical and ultimate methods for landmark extraction"""
         
@@ -227,9 +220,13 @@ class PLYLandmarkExtractor:
         print("ANATOMICAL vs ULTIMATE LANDMARK COMPARISON")
         print(f"{'='*80}")
         
-        # Extract with both methods
-        anatomical_results = self.extract_and_analyze_batch(ply_files, 'anatomical')
-        ultimate_results = self.extract_and_analyze_batch(ply_files, 'ultimate')
+        # Extract with both methods in a single pass over the files
+        extracted = self.extract_landmark_pairs(ply_files, ('anatomical', 'ultimate'))
+        
+        print(f"\n📊 ANATOMICAL method:")
+        anatomical_results = self.analyze_landmark_pairs(*extracted['anatomical'])
+        print(f"\n📊 ULTIMATE method:")
+        ultimate_results = self.analyze_landmark_pairs(*extracted['ultimate'])
         
         if anatomical_results and ultimate_results:
             self.generate_comparison_report(anatomical_results, ultimate_results)
@@ -243,28 +240,36 @@ class PLYLandmarkExtractor:
         print("METHOD COMPARISON REPORT")
         print(f"{'='*90}")
         
-        # Extract NME values
-        anat_nme = [r['overall_stats']['mean_normalized_error'] for r in anatomical_results]
-        ult_nme = [r['overall_stats']['mean_normalized_error'] for r in ultimate_results]
-        
-        print(f"\n📊 OVERALL COMPARISON:")
-        print(f"   Anatomical Method:")
-        print(f"     Mean NME: {np.mean(anat_nme):.4f} ± {np.std(anat_nme):.4f}")
-        print(f"     Best: {np.min(anat_nme):.4f}")
-        print(f"     Worst: {np.max(anat_nme):.4f}")
-        
-        print(f"   Ultimate Method:")
-        print(f"     Mean NME: {np.mean(ult_nme):.4f} ± {np.std(ult_nme):.4f}")
-        print(f"     Best: {np.min(ult_nme):.4f}")
-        print(f"     Worst: {np.max(ult_nme):.4f}")
+        # Pair the methods per file (either may have failed on some files) and stack the NMEs
+        # into one (N, 2) array, anatomical then ultimate, so each statistic is a single reduction
+        ult_by_file = {r['subject_id'].replace('_ultimate', ''): r for r in ultimate_results}
+        files = []
+        pairs = []
+        for anat_r in anatomical_results:
+            name = anat_r['subject_id'].replace('_anatomical', '')
+            ult_r = ult_by_file.get(name)
+            if ult_r is not None:
+                files.append(name)
+                pairs.append((anat_r['overall_stats']['mean_normalized_error'],
+                              ult_r['overall_stats']['mean_normalized_error']))
+        
+        if not pairs:
+            print("❌ No files processed by both methods")
+            return
+        
+        nme = np.array(pairs)
+        mean, std, best, worst = nme.mean(axis=0), nme.std(axis=0), nme.min(axis=0), nme.max(axis=0)
+        
+        print(f"\n📊 OVERALL COMPARISON ({len(files)} files):")
+        for col, label in enumerate(("Anatomical", "Ultimate")):
+            print(f"   {label} Method:")
+            print(f"     Mean NME: {mean[col]:.4f} ± {std[col]:.4f}")
+            print(f"     Best: {best[col]:.4f}")
+            print(f"     Worst: {worst[col]:.4f}")
         
         # Statistical comparison
-        if np.mean(anat_nme) < np.mean(ult_nme):
-            winner = "ANATOMICAL"
-            improvement = np.mean(ult_nme) / np.mean(anat_nme)
-        else:
-            winner = "ULTIMATE"
-            improvement = np.mean(anat_nme) / np.mean(ult_nme)
+        winner = "ANATOMICAL" if mean[0] < mean[1] else "ULTIMATE"
+        improvement = mean.max() / mean.min()
         
         print(f"\n🏆 WINNER: {winner} method")
         print(f"   Improvement: {improvement:.2f}x better average NME")
@@ -274,16 +279,9 @@ class PLYLandmarkExtractor:
         print(f"{'File':<20} {'Anatomical NME':<15} {'Ultimate NME':<15} {'Better Method'}")
         print("-" * 70)
         
-        for i, (anat_r, ult_r) in enumerate(zip(anatomical_results, ultimate_results)):
-            anat_file = anat_r['subject_id'].replace('_anatomical', '')
-            ult_file = ult_r['subject_id'].replace('_ultimate', '')
-            
-            anat_val = anat_r['overall_stats']['mean_normalized_error']
-            ult_val = ult_r['overall_stats']['mean_normalized_error']
-            
-            better = "Anatomical" if anat_val < ult_val else "Ultimate"
-            
-            print(f"{anat_file:<20} {anat_val:<15.4f} {ult_val:<15.4f} {better}")
+        better = np.where(nme[:, 0] < nme[:, 1], "Anatomical", "Ultimate")
+        for name, (anat_val, ult_val), better_method in zip(files, nme, better):
+            print(f"{name:<20} {anat_val:<15.4f} {ult_val:<15.4f} {better_method}")
 
 def main():
     """Main function for PLY landmark extraction and analysis"""
@@ -301,15 +299,9 @@ def main():
     men_dir = "assets/files/class1/men"
     women_dir = "assets/files/class1/women"
     
-    if os.path.exists(men_dir):
-        men_files = [os.path.join(men_dir, f) for f in os.listdir(men_dir) 
-                    if f.endswith('.ply')][:3]  # Take first 3
-        test_files.extend(men_files)
-    
-    if os.path.exists(women_dir):
-        women_files = [os.path.join(women_dir, f) for f in os.listdir(women_dir) 
-                      if f.endswith('.ply')][:3]  # Take first 3
-        test_files.extend(women_files)
+    # A missing directory simply yields no matches
+    for ply_dir in (men_dir, women_dir):
+        test_files.extend(map(str, sorted(Path(ply_dir).glob('*.ply'))[:3]))  # Take first 3
     
     if not test_files:
         print("❌ No PLY files found for testing!")
@@ -4,8 +4,9 @@ Poor Performance Analyzer
 Analyzes which files performed poorly in both anatomical and ultimate methods
 """
 
-import json
 import os
+import numpy as np
+from utils.util import iter_report_items, save_report_json
 
 def analyze_poor_performers():
     """Analyze comprehensive test results to find files poor in both methods"""
@@ -14,9 +15,6 @@ def analyze_poor_performers():
         print("❌ comprehensive_test_results.json not found!")
         return
     
-    with open('comprehensive_test_results.json', 'r') as f:
-        results = json.load(f)
-    
     print(f"\n{'='*80}")
     print("POOR PERFORMANCE ANALYSIS")
     print(f"{'='*80}")
@@ -24,63 +22,54 @@ def analyze_poor_performers():
     # Define thresholds
     poor_threshold = 10000  # RANSAC error >= 10000 is considered poor
     
-    # Categorize results
-    both_tested = []
-    both_poor = []
-    anatomical_poor_ultimate_good = []
-    anatomical_good_ultimate_poor = []
-    anatomical_only = []
-    ultimate_only = []
-    
-    for result in results:
-        file_name = result['file']
+    # Stream the records and keep only the fields used below (None where a method was not run);
+    # the errors then become arrays, so every category is a boolean mask over them
+    files = []
+    categories = []
+    anat_errors = []
+    ult_errors = []
+    anat_tested = []
+    ult_tested = []
+    for result in iter_report_items('comprehensive_test_results.json'):
         anat_result = result.get('anatomical_result')
         ult_result = result.get('ultimate_result')
-        
-        has_anatomical = anat_result is not None
-        has_ultimate = ult_result is not None
-        
-        if has_anatomical and has_ultimate:
-            both_tested.append(result)
-            
-            anat_ransac = anat_result['ransac_error']
-            ult_ransac = ult_result['ransac_error']
-            
-            anat_poor = anat_ransac >= poor_threshold
-            ult_poor = ult_ransac >= poor_threshold
-            
-            if anat_poor and ult_poor:
-                both_poor.append({
-                    'file': file_name,
-                    'category': result['category'],
-                    'anatomical_ransac': anat_ransac,
-                    'ultimate_ransac': ult_ransac
-                })
-            elif anat_poor and not ult_poor:
-                anatomical_poor_ultimate_good.append({
-                    'file': file_name,
-                    'category': result['category'],
-                    'anatomical_ransac': anat_ransac,
-                    'ultimate_ransac': ult_ransac
-                })
-            elif not anat_poor and ult_poor:
-                anatomical_good_ultimate_poor.append({
-                    'file': file_name,
-                    'category': result['category'],
-                    'anatomical_ransac': anat_ransac,
-                    'ultimate_ransac': ult_ransac
-                })
-        
-        elif has_anatomical and not has_ultimate:
-            anatomical_only.append(result)
-        elif not has_anatomical and has_ultimate:
-            ultimate_only.append(result)
+        files.append(result['file'])
+        categories.append(result.get('category'))
+        anat_tested.append(anat_result is not None)
+        ult_tested.append(ult_result is not None)
+        anat_errors.append(anat_result['ransac_error'] if anat_result is not None else None)
+        ult_errors.append(ult_result['ransac_error'] if ult_result is not None else None)
+    
+    has_anatomical = np.array(anat_tested, dtype=bool)
+    has_ultimate = np.array(ult_tested, dtype=bool)
+    anat_ransac = np.array(anat_errors, dtype=np.float64)  # None becomes NaN
+    ult_ransac = np.array(ult_errors, dtype=np.float64)
+    
+    # NaN compares False, so untested methods never count as poor
+    anat_poor = anat_ransac >= poor_threshold
+    ult_poor = ult_ransac >= poor_threshold
+    both_tested = has_anatomical & has_ultimate
+    
+    def summarize(mask):
+        return [{
+            'file': files[i],
+            'category': categories[i],
+            'anatomical_ransac': anat_errors[i],
+            'ultimate_ransac': ult_errors[i]
+        } for i in np.flatnonzero(mask)]
+    
+    both_poor = summarize(both_tested & anat_poor & ult_poor)
+    anatomical_poor_ultimate_good = summarize(both_tested & anat_poor & ~ult_poor)
+    anatomical_good_ultimate_poor = summarize(both_tested & ~anat_poor & ult_poor)
+    both_tested_count = int(both_tested.sum())
+    anatomical_only_count = int((has_anatomical & ~has_ultimate).sum())
+    ultimate_only_count = int((~has_anatomical & has_ultimate).sum())
     
     print(f"\n📊 TESTING COVERAGE:")
-    print(f"   Files tested with both methods: {len(both_tested)}")
-    print(f"   Files tested with anatomical only: {len(anatomical_only)}")
-    print(f"   Files tested with ultimate only: {len(ultimate_only)}")
-    print(f"   Total files: {len(results)}")
+    print(f"   Files tested with both methods: {both_tested_count}")
+    print(f"   Files tested with anatomical only: {anatomical_only_count}")
+    print(f"   Files tested with ultimate only: {ultimate_only_count}")
+    print(f"   Total files: {len(files)}")
     
     print(f"\n⚠️ POOR PERFORMERS (RANSAC ≥ {poor_threshold:,}):")
     
@@ -124,23 +113,21 @@ def analyze_poor_performers():
     print(f"\n📈 CATEGORY ANALYSIS:")
     
     if both_poor:
-        men_both_poor = [x for x in both_poor if x['category'] == 'men']
-        women_both_poor = [x for x in both_poor if x['category'] == 'women']
+        men_both_poor = sum(x['category'] == 'men' for x in both_poor)
+        women_both_poor = sum(x['category'] == 'women' for x in both_poor)
         
         print(f"   Both methods poor:")
-        print(f"     Men: {len(men_both_poor)} files")
-        print(f"     Women: {len(women_both_poor)} files")
+        print(f"     Men: {men_both_poor} files")
+        print(f"     Women: {women_both_poor} files")
     
     # Method effectiveness
     print(f"\n🔄 METHOD EFFECTIVENESS:")
     
-    total_anatomical = len([r for r in results if r.get('anatomical_result')])
-    total_ultimate = len([r for r in results if r.get('ultimate_result')])
+    total_anatomical = int(has_anatomical.sum())
+    total_ultimate = int(has_ultimate.sum())
     
-    anatomical_poor_count = len([r for r in results if r.get('anatomical_result') and 
-                                r['anatomical_result']['ransac_error'] >= poor_threshold])
-    ultimate_poor_count = len([r for r in results if r.get('ultimate_result') and 
-                              r['ultimate_result']['ransac_error'] >= poor_threshold])
+    anatomical_poor_count = int(anat_poor.sum())
+    ultimate_poor_count = int(ult_poor.sum())
     
     if total_anatomical > 0:
         anatomical_success_rate = (total_anatomical - anatomical_poor_count) / total_anatomical * 100
@@ -168,16 +155,15 @@ def analyze_poor_performers():
         'anatomical_poor_ultimate_good': anatomical_poor_ultimate_good,
         'anatomical_good_ultimate_poor': anatomical_good_ultimate_poor,
         'summary': {
-            'total_files': len(results),
-            'both_tested': len(both_tested),
+            'total_files': len(files),
+            'both_tested': both_tested_count,
             'both_poor_count': len(both_poor),
-            'anatomical_only_count': len(anatomical_only),
-            'ultimate_only_count': len(ultimate_only)
+            'anatomical_only_count': anatomical_only_count,
+            'ultimate_only_count': ultimate_only_count
         }
     }
     
-    with open('poor_performance_analysis.json', 'w') as f:
-        json.dump(analysis_results, f, indent=2)
+    save_report_json(analysis_results, 'poor_performance_analysis.json')
     
     print(f"\n💾 Analysis saved to: poor_performance_analysis.json")
     
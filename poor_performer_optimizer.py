@@ -5,15 +5,15 @@ Automatically applies hybrid optimization to files that show poor performance wi
 """
 
 import os
-import sys
 import json
-import subprocess
-import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from anatomical_aligner import AnatomicalAligner
+from predict import PREDICT_TIMEOUT, predict, predict_many
+from utils.util import fast_temp_dir
 
 class PoorPerformerOptimizer:
     def __init__(self):
-        self.python_path = "/Users/eck/Documents/Projects/Face-Landmark/Deep-MVLM/env/bin/python"
         self.anatomical_config = "configs/DTU3D-anatomical.json"
         self.ultimate_config = "configs/DTU3D-PLY-ultimate-final.json"
         
@@ -25,9 +25,11 @@ class PoorPerformerOptimizer:
             ("27.ply", "women", 68493157.13),
             ("29.ply", "women", 23287685.52)
         ]
+        self.max_workers = os.cpu_count() or 1  # Poor performers optimized in parallel
+        self.max_batch = 8  # Preprocessed files per predict_many call
     
-    def test_ultimate_preprocessing(self, filename, category):
-        """Test ultimate preprocessing on a poor performer"""
+    def preprocess_ultimate(self, filename, category):
+        """Apply ultimate preprocessing to a poor performer; returns the temp PLY path or None"""
         
         if category == "men":
             filepath = f"assets/files/class1/men/{filename}"
@@ -39,7 +41,10 @@ class PoorPerformerOptimizer:
             return None
         
         base_name = os.path.splitext(filename)[0]
-        temp_file = f"temp_ultimate_{base_name}.ply"
+        # Unique temp path on tmpfs when available, safe for parallel workers
+        with tempfile.NamedTemporaryFile(prefix=f"temp_ultimate_{base_name}_", suffix='.ply',
+                                         dir=fast_temp_dir(), delete=False) as tf:
+            temp_file = tf.name
         
         print(f"\n🔧 Optimizing {filename} with ULTIMATE preprocessing:")
         print(f"   Input: {filepath}")
@@ -50,52 +55,7 @@ class PoorPerformerOptimizer:
             from ultimate_ply_preprocessor import align_ply_to_obj_system
             align_ply_to_obj_system(filepath, temp_file)
             print(f"   ✅ Ultimate preprocessing completed")
-            
-            # Run prediction
-            cmd = [self.python_path, "predict.py", "--c", self.ultimate_config, "--n", temp_file]
-            
-            pred_result = subprocess.run(cmd, capture_output=True, text=True, timeout=200)
-            output = pred_result.stderr + pred_result.stdout
-            
-            ransac_pattern = r"Ransac average error\s+([\d.]+)"
-            match = re.search(ransac_pattern, output)
-            
-            if match:
-                ransac_error = float(match.group(1))
-                
-                if ransac_error < 10:
-                    performance = "🔥 EXCELLENT"
-                    status = "excellent"
-                elif ransac_error < 100:
-                    performance = "🎉 VERY GOOD"
-                    status = "very_good"
-                elif ransac_error < 10000:
-                    performance = "✅ GOOD"
-                    status = "good"
-                else:
-                    performance = "⚠️ STILL POOR"
-                    status = "poor"
-                
-                print(f"   🎯 RESULT: RANSAC {ransac_error:.2f} ({performance})")
-                
-                result = {
-                    'file': base_name,
-                    'category': category,
-                    'method': 'ultimate',
-                    'ransac_error': ransac_error,
-                    'performance': performance,
-                    'status': status,
-                    'optimization_successful': ransac_error < 100
-                }
-                
-                # Cleanup
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                
-                return result
-            else:
-                print(f"   ❌ Could not extract RANSAC error")
-                
+            return temp_file
         except Exception as e:
             print(f"   ❌ Optimization failed: {e}")
         
@@ -105,6 +65,82 @@ class PoorPerformerOptimizer:
         
         return None
     
+    def predict_ultimate(self, temp_file):
+        """In-process prediction of one preprocessed file; returns its RANSAC error or None"""
+        try:
+            return predict(self.ultimate_config, temp_file, timeout=PREDICT_TIMEOUT)
+        except Exception as e:
+            print(f"   ❌ Prediction failed: {e}")
+            return None
+    
+    def predict_ultimate_batch(self, temp_files):
+        """In-process prediction of a batch of preprocessed files; returns their RANSAC errors"""
+        try:
+            return predict_many(self.ultimate_config, temp_files, timeout=PREDICT_TIMEOUT * len(temp_files))
+        except Exception as e:
+            print(f"   ❌ Batched prediction failed ({e}), predicting files one by one")
+            return [self.predict_ultimate(temp_file) for temp_file in temp_files]
+    
+    def ultimate_result(self, filename, category, ransac_error):
+        """Classify the RANSAC error of an ultimate-preprocessed file; returns its result or None"""
+        base_name = os.path.splitext(filename)[0]
+        
+        if ransac_error is None:
+            print(f"   ❌ Could not extract RANSAC error for {filename}")
+            return None
+        
+        ransac_error = float(ransac_error)
+        
+        if ransac_error < 10:
+            performance = "🔥 EXCELLENT"
+            status = "excellent"
+        elif ransac_error < 100:
+            performance = "🎉 VERY GOOD"
+            status = "very_good"
+        elif ransac_error < 10000:
+            performance = "✅ GOOD"
+            status = "good"
+        else:
+            performance = "⚠️ STILL POOR"
+            status = "poor"
+        
+        print(f"   🎯 RESULT {filename}: RANSAC {ransac_error:.2f} ({performance})")
+        
+        return {
+            'file': base_name,
+            'category': category,
+            'method': 'ultimate',
+            'ransac_error': ransac_error,
+            'performance': performance,
+            'status': status,
+            'optimization_successful': ransac_error < 100
+        }
+    
+    def prepare_poor_performer(self, poor_performer, position):
+        """Preprocess one (filename, category, original_ransac) entry; returns its temp PLY path or None"""
+        filename, category, original_ransac = poor_performer
+        print(f"\n{'='*60}")
+        print(f"[{position}] OPTIMIZING: {filename}")
+        print(f"{'='*60}")
+        print(f"Original anatomical RANSAC: {original_ransac:.2f}")
+        
+        return self.preprocess_ultimate(filename, category)
+    
+    def optimization_row(self, poor_performer, result):
+        """Report row comparing the anatomical RANSAC of a poor performer with its ultimate result"""
+        original_ransac = poor_performer[2]
+        return {
+            'file': result['file'],
+            'category': result['category'],
+            'original_method': 'anatomical',
+            'original_ransac': original_ransac,
+            'optimized_method': 'ultimate',
+            'optimized_ransac': result['ransac_error'],
+            'improvement': original_ransac / result['ransac_error'],
+            'optimization_successful': result['optimization_successful'],
+            'final_status': result['status']
+        }
+    
     def optimize_all_poor_performers(self):
         """Optimize all identified poor performers"""
         
@@ -118,27 +154,35 @@ class PoorPerformerOptimizer:
         for filename, category, ransac in self.poor_performers:
             print(f"{filename:<12} {category:<8} {ransac:<20.2f}")
         
-        optimization_results = []
+        # The files are independent, so each one is preprocessed in its own process; map()
+        # keeps the temp files in the listed order
+        positions = [f"{i}/{len(self.poor_performers)}" for i in range(1, len(self.poor_performers) + 1)]
+        max_workers = max(1, min(self.max_workers, len(self.poor_performers)))
         
-        for i, (filename, category, original_ransac) in enumerate(self.poor_performers, 1):
-            print(f"\n{'='*60}")
-            print(f"[{i}/{len(self.poor_performers)}] OPTIMIZING: {filename}")
-            print(f"{'='*60}")
-            print(f"Original anatomical RANSAC: {original_ransac:.2f}")
-            
-            result = self.test_ultimate_preprocessing(filename, category)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            prepared = [(poor_performer, temp_file) for poor_performer, temp_file
+                        in zip(self.poor_performers,
+                               executor.map(self.prepare_poor_performer, self.poor_performers, positions))
+                        if temp_file]
+        
+        # The model is loaded once here and predicts the preprocessed files in bounded batches,
+        # so only one batch of renderings is held in memory; a failed batch falls back to
+        # predicting its files one by one
+        temp_files = [temp_file for _, temp_file in prepared]
+        ransac_errors = []
+        try:
+            for i in range(0, len(temp_files), self.max_batch):
+                ransac_errors.extend(self.predict_ultimate_batch(temp_files[i:i + self.max_batch]))
+        finally:
+            for temp_file in temp_files:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+        
+        optimization_results = []
+        for (poor_performer, _), ransac_error in zip(prepared, ransac_errors):
+            result = self.ultimate_result(poor_performer[0], poor_performer[1], ransac_error)
             if result:
-                optimization_results.append({
-                    'file': result['file'],
-                    'category': result['category'],
-                    'original_method': 'anatomical',
-                    'original_ransac': original_ransac,
-                    'optimized_method': 'ultimate',
-                    'optimized_ransac': result['ransac_error'],
-                    'improvement': original_ransac / result['ransac_error'],
-                    'optimization_successful': result['optimization_successful'],
-                    'final_status': result['status']
-                })
+                optimization_results.append(self.optimization_row(poor_performer, result))
         
         # Generate optimization report
         self.generate_optimization_report(optimization_results)
@@ -3,6 +3,79 @@ from parse_config import ConfigParser
 import deepmvlm
 from utils3d import Utils3D
 import os
+import copy
+import torch
+from functools import lru_cache
+from utils.util import time_limit
+
+# seconds one in-process prediction may take in a pool worker, as the predict.py subprocesses had
+PREDICT_TIMEOUT = 300
+
+
+def _load_config(config_path, overrides=()):
+    return ConfigParser(argparse.Namespace(config=config_path, device=None, name=None),
+                        modification=dict(overrides))
+
+
+@lru_cache(maxsize=None)
+def load_predictor(config_path):
+    # one loaded model per config and process, reused across calls
+    return deepmvlm.DeepMVLM(_load_config(config_path))
+
+
+@lru_cache(maxsize=32)
+def _override_predictor(config_path, overrides):
+    # overrides only change how meshes are rendered and aligned, never the network, so the
+    # variant shares the model of the base config and just swaps in the modified config
+    dm = copy.copy(load_predictor(config_path))
+    dm.config = _load_config(config_path, overrides)
+    return dm
+
+
+def predict(config_path, file_name, overrides=None, timeout=None):
+    """Predict landmarks for one mesh in-process and return the RANSAC average error
+
+    overrides maps key paths to values, e.g. {('pre-align', 'rot_x'): 90}, and is applied
+    to the loaded config in memory instead of writing a modified config file.
+    A timeout in seconds raises TimeoutError when the prediction takes longer.
+    """
+    overrides = tuple(sorted((overrides or {}).items()))
+    dm = _override_predictor(config_path, overrides) if overrides else load_predictor(config_path)
+    with time_limit(timeout):
+        dm.predict_one_file(file_name)
+    return dm.ransac_average_error
+
+
+def predict_many(config_path, file_names, timeout=None):
+    """Predict landmarks for several meshes in-process and return their RANSAC average errors
+
+    The views of all meshes go through the network together, so the model is loaded once
+    and the batches stay full across file boundaries. The timeout covers the whole call.
+    """
+    dm = load_predictor(config_path)
+    with time_limit(timeout):
+        dm.predict_files(list(file_names))
+    return dm.ransac_average_errors
+
+
+def predict_landmarks(config_path, file_name, timeout=None):
+    """Predict landmarks for one mesh in-process and return them as an (n, 3) array"""
+    dm = load_predictor(config_path)
+    with time_limit(timeout):
+        return dm.predict_one_file(file_name)
+
+
+def warm_predictors(*config_paths):
+    # pool initializer: load every model once when a worker starts, before the first file arrives
+    for config_path in config_paths:
+        load_predictor(config_path)
+
+
+def init_predict_worker(n_workers, *config_paths):
+    # pool initializer: split the cores between the workers, since torch would otherwise start
+    # one intra-op thread per core in every one of them, then warm the given models
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // n_workers))
+    warm_predictors(*config_paths)
 
 
 def process_one_file(config, file_name):
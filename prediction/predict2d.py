@@ -190,7 +190,8 @@ class Predict2D:
             imageio.imwrite(name_hm_maxima_2, im_marked)
 
     def predict_heatmaps_from_images(self, image_stack):
-        n_views = self.config['data_loader']['args']['n_views']
+        # normally the n_views renderings of one mesh, but the views of several meshes can be stacked
+        n_views = image_stack.shape[0]
         batch_size = self.config['data_loader']['args']['batch_size']
         n_landmarks = self.config['arch']['args']['n_landmarks']
 
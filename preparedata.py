@@ -2,7 +2,9 @@ import argparse
 from parse_config import ConfigParser
 import os
 import socket
+from concurrent.futures import ProcessPoolExecutor
 import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 import numpy as np
 
 
@@ -17,21 +19,29 @@ def delete_lock_file(name):
         os.remove(name)
 
 
-def random_transform(config):
-    min_x = config['process_3d']['min_x_angle']
-    max_x = config['process_3d']['max_x_angle']
-    min_y = config['process_3d']['min_y_angle']
-    max_y = config['process_3d']['max_y_angle']
-    min_z = config['process_3d']['min_z_angle']
-    max_z = config['process_3d']['max_z_angle']
+# one generator per process; pool workers reseed it so they do not replay the parent's views
+_rng = np.random.default_rng()
 
-    rx = np.double(np.random.randint(min_x, max_x, 1))
-    ry = np.double(np.random.randint(min_y, max_y, 1))
-    rz = np.double(np.random.randint(min_z, max_z, 1))
+
+def seed_random_views():
+    global _rng
+    _rng = np.random.default_rng()
+
+
+def view_angle_bounds(config):
+    # (low, high) for rx, ry, rz, tx, ty, read once per file instead of once per view
+    low = np.array([config['process_3d']['min_x_angle'], config['process_3d']['min_y_angle'],
+                    config['process_3d']['min_z_angle'], -20, -20])
+    high = np.array([config['process_3d']['max_x_angle'], config['process_3d']['max_y_angle'],
+                     config['process_3d']['max_z_angle'], 20, 20])
+    return low, high
+
+
+def random_transform(bounds):
+    low, high = bounds
+    rx, ry, rz, tx, ty = _rng.integers(low, high).astype(np.double).tolist()
     # TODO the following values are not used
-    scale = np.double(np.random.uniform(1.4, 1.9, 1))
-    tx = np.double(np.random.randint(-20, 20, 1))
-    ty = np.double(np.random.randint(-20, 20, 1))
+    scale = _rng.uniform(1.4, 1.9)
 
     return rx, ry, rz, scale, tx, ty
 
@@ -71,26 +81,26 @@ def process_file_bu_3dfe(config, file_name, output_dir):
     win_size = config['data_loader']['args']['image_size']
     off_screen_rendering = config['preparedata']['off_screen_rendering']
     n_views = config['data_loader']['args']['n_views']
+    view_bounds = view_angle_bounds(config)
     slack = 5
 
-    # Load Landmarks
-    points = vtk.vtkPoints()
-    lms = vtk.vtkPolyData()
-
-    with open(name_lm) as f:
-        for line in f:
-            line = line.strip("/n")
-            x, y, z = np.double(line.split(" "))
-            points.InsertNextPoint(x, y, z)
-    lms.SetPoints(points)
-    del points
+    # Load Landmarks; they are transformed and projected with numpy per view, not through VTK filters
+    lm_np = np.loadtxt(name_lm, dtype=np.float64, ndmin=2)
 
     vrmlin = vtk.vtkVRMLImporter()
     vrmlin.SetFileName(name_pd)
     vrmlin.Update()
 
-    pd = vrmlin.GetRenderer().GetActors().GetLastActor().GetMapper().GetInput()
-    pd.GetPointData().SetScalars(None)
+    # Render from a topology-only copy holding just what the actors draw (texture coordinates
+    # for the textured pass, normals for the shaded one); scalars and any other imported
+    # arrays are left behind instead of being reset and still uploaded with the mesh
+    pd_vrml = vrmlin.GetRenderer().GetActors().GetLastActor().GetMapper().GetInput()
+    pd = vtk.vtkPolyData()
+    pd.SetPoints(pd_vrml.GetPoints())
+    pd.SetPolys(pd_vrml.GetPolys())
+    pd.GetPointData().SetTCoords(pd_vrml.GetPointData().GetTCoords())
+    pd.GetPointData().SetNormals(pd_vrml.GetPointData().GetNormals())
+    pd_vertices = vtk_to_numpy(pd.GetPoints().GetData())
 
     # Load texture
     texture_image = vtk.vtkBMPReader()
@@ -121,22 +131,14 @@ def process_file_bu_3dfe(config, file_name, output_dir):
     t.Identity()
     t.Update()
 
-    # Transform (assuming only one mesh)
-    trans = vtk.vtkTransformPolyDataFilter()
-    trans.SetInputData(pd)
-    trans.SetTransform(t)
-    trans.Update()
-
-    trans_lm = vtk.vtkTransformPolyDataFilter()
-    trans_lm.SetInputData(lms)
-    trans_lm.SetTransform(t)
-    trans_lm.Update()
-
+    # The mesh is rendered untouched; both actors apply the view transform while drawing,
+    # so no transformed copy of the mesh is made per view (assuming only one mesh)
     mapper = vtk.vtkPolyDataMapper()
-    mapper.SetInputData(trans.GetOutput())
+    mapper.SetInputData(pd)
 
     actor_text = vtk.vtkActor()
     actor_text.SetMapper(mapper)
+    actor_text.SetUserTransform(t)
     actor_text.SetTexture(texture)
     actor_text.GetProperty().SetColor(1, 1, 1)
     actor_text.GetProperty().SetAmbient(1.0)
@@ -146,6 +148,7 @@ def process_file_bu_3dfe(config, file_name, output_dir):
 
     actor_geometry = vtk.vtkActor()
     actor_geometry.SetMapper(mapper)
+    actor_geometry.SetUserTransform(t)
     ren.AddActor(actor_geometry)
 
     w2if = vtk.vtkWindowToImageFilter()
@@ -170,22 +173,24 @@ def process_file_bu_3dfe(config, file_name, output_dir):
 
         if not os.path.isfile(name_rgb):
             # print('Rendering ', name_rgb)
-            rx, ry, rz, s, tx, ty = random_transform(config)
+            rx, ry, rz, s, tx, ty = random_transform(view_bounds)
 
             t.Identity()
             t.RotateY(ry)
             t.RotateX(rx)
             t.RotateZ(rz)
             t.Update()
-            trans.Update()
-            trans_lm.Update()
+            m = t.GetMatrix()
+            m_np = np.array([[m.GetElement(i, j) for j in range(4)] for i in range(4)])
 
             xmin = -150
             xmax = 150
             ymin = -150
             ymax = 150
-            zmin = trans.GetOutput().GetBounds()[4]
-            zmax = trans.GetOutput().GetBounds()[5]
+            # Only the depth range of the transformed mesh is needed for the clipping planes
+            z_pos = pd_vertices @ m_np[2, :3] + m_np[2, 3]
+            zmin = z_pos.min()
+            zmax = z_pos.max()
             xlen = xmax - xmin
             ylen = ymax - ymin
 
@@ -223,8 +228,7 @@ def process_file_bu_3dfe(config, file_name, output_dir):
             writer_png.SetFileName(name_geometry)
             writer_png.Write()
 
-            ren.Modified()  # force actors to have the correct visibility
-            ren_win.Render()
+            # The depth buffer of the geometry pass is still in the window; read it back directly
             w2if.SetInputBufferTypeToZBuffer()
             w2if.Modified()
 
@@ -235,23 +239,16 @@ def process_file_bu_3dfe(config, file_name, output_dir):
             ren.Modified()
 
             # Write transformed landmarks
-            f = open(name_2dlm, 'w')
-
-            t_lm = trans_lm.GetOutput()
-            for i in range(t_lm.GetNumberOfPoints()):
-                x_pos = t_lm.GetPoint(i)[0]
-                y_pos = t_lm.GetPoint(i)[1]
-
-                x_pos_screen = (x_pos - cx) * zoom_fac + win_size / 2
-                y_pos_screen = -(y_pos - cy) * zoom_fac + win_size / 2
-
-                line = str(x_pos_screen) + ' ' + str(y_pos_screen) + '\n'
-                f.write(line)
-            f.close()
-
-    del writer_png_2, writer_png, ren_win, actor_geometry, actor_text, mapper, w2if, t, trans, vrmlin, texture
+            # Rotate all landmarks with the view matrix, then map x, y to the parallel-projected screen
+            t_lm = lm_np @ m_np[:3, :3].T + m_np[:3, 3]
+            lm_screen = np.empty((len(t_lm), 2))
+            lm_screen[:, 0] = (t_lm[:, 0] - cx) * zoom_fac + win_size / 2
+            lm_screen[:, 1] = -(t_lm[:, 1] - cy) * zoom_fac + win_size / 2
+            np.savetxt(name_2dlm, lm_screen, fmt='%.6f', delimiter=' ')
+
+    del writer_png_2, writer_png, ren_win, actor_geometry, actor_text, mapper, w2if, t, vrmlin, texture
     del texture_image
-    del lms, trans_lm
+    del lm_np, pd_vertices
 
     delete_lock_file(lock_file)
 
@@ -316,9 +313,19 @@ def prepare_bu_3dfe_data(config):
 
     print('Processing ', len(base_file_names), ' file ids for training')
 
-    for base_name in base_file_names:
-        print('Processing ', base_name)
-        process_file_bu_3dfe(config, base_name, output_dir)
+    # Files render independently, each worker in its own off-screen window. The workers get the
+    # full plain config dict (ConfigParser itself is not shipped) and reseed the view generator
+    # so they do not all draw the same random views
+    max_workers = os.cpu_count() or 1
+    worker_config = config.config
+    if max_workers > 1 and not worker_config['preparedata']['off_screen_rendering']:
+        print('Rendering off-screen in', max_workers, 'worker processes (off_screen_rendering is ignored)')
+        worker_config = dict(worker_config, preparedata=dict(worker_config['preparedata'],
+                                                             off_screen_rendering=True))
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=seed_random_views) as executor:
+        list(executor.map(process_file_bu_3dfe, [worker_config] * len(base_file_names),
+                          base_file_names, [output_dir] * len(base_file_names)))
 
 
 def main(config):
@@ -7,8 +7,9 @@ Alignment without changing the scale to preserve manual landmark coordinates.
 import vtk
 import numpy as np
 import os
-import json
 from anatomical_aligner import AnatomicalAligner
+from utils.util import load_base_config, save_config_if_changed
+from utils3d import Utils3D
 
 class ScaleFreeAligner(AnatomicalAligner):
     def __init__(self):
@@ -53,8 +54,11 @@ class ScaleFreeAligner(AnatomicalAligner):
             'anatomy_guess': anatomy['orientation_guess']
         }
     
-    def apply_scale_free_alignment(self, ply_path, output_path):
-        """Apply anatomical alignment without scale modification"""
+    def apply_scale_free_alignment(self, ply_path, output_path, mesh=None):
+        """Apply anatomical alignment without scale modification
+
+        Pass an already loaded vtkPolyData as ``mesh`` to avoid parsing the PLY again.
+        """
         
         print(f"\n🎯 Applying Scale-Free Anatomical Alignment")
         print(f"Input: {os.path.basename(ply_path)}")
@@ -63,7 +67,7 @@ class ScaleFreeAligner(AnatomicalAligner):
         print("=" * 70)
         
         # Analyze PLY
-        ply_analysis = self.analyze_ply_anatomy(ply_path)
+        ply_analysis = self.analyze_ply_anatomy(ply_path, mesh=mesh)
         
         # Calculate transform WITHOUT scale
         transform_params = self.calculate_anatomical_transform_no_scale(ply_analysis)
@@ -71,58 +75,44 @@ class ScaleFreeAligner(AnatomicalAligner):
         # Apply transform using VTK
         mesh = ply_analysis['mesh']
         
-        # Create VTK transform
-        vtk_transform = vtk.vtkTransform()
-        vtk_transform.PostMultiply()
-        
-        # Apply ONLY translation and rotation (NO SCALE)
-        
-        # 1. Translate to origin first
-        vtk_transform.Translate(transform_params['translation'])
-        
-        # 2. Apply rotation only
-        rotation_matrix = transform_params['rotation_matrix']
-        vtk_matrix = vtk.vtkMatrix4x4()
-        for i in range(3):
-            for j in range(3):
-                vtk_matrix.SetElement(i, j, rotation_matrix[i, j])
-        vtk_transform.Concatenate(vtk_matrix)
-        
-        # 3. NO SCALE APPLICATION - This preserves manual landmark coordinates!
-        
-        # Apply transform to mesh
-        transform_filter = vtk.vtkTransformPolyDataFilter()
-        transform_filter.SetInputData(mesh)
-        transform_filter.SetTransform(vtk_transform)
-        transform_filter.Update()
+        # Compose translate -> rotate into one rigid matrix and apply it in a single pass;
+        # NO SCALE APPLICATION - This preserves manual landmark coordinates!
+        translate = np.eye(4)
+        translate[:3, 3] = transform_params['translation']
+        rotate = np.eye(4)
+        rotate[:3, :3] = transform_params['rotation_matrix']
+        transformed_mesh = Utils3D.transform_points(mesh, rotate @ translate)
         
         # Clean up the result
         clean_filter = vtk.vtkCleanPolyData()
-        clean_filter.SetInputData(transform_filter.GetOutput())
+        clean_filter.SetInputData(transformed_mesh)
         clean_filter.Update()
         
-        # Generate smooth normals
-        normals = vtk.vtkPolyDataNormals()
-        normals.SetInputData(clean_filter.GetOutput())
-        normals.ComputePointNormalsOn()
-        normals.ComputeCellNormalsOn()
-        normals.SplittingOff()
-        normals.ConsistencyOn()
-        normals.AutoOrientNormalsOn()
-        normals.Update()
-        
-        final_mesh = normals.GetOutput()
+        if clean_filter.GetOutput().GetPointData().GetNormals() is not None:
+            # A rigid transform only rotates the input's normals, which transform_points has
+            # already done, so there is nothing to recompute
+            final_mesh = clean_filter.GetOutput()
+        else:
+            # Generate smooth normals
+            normals = vtk.vtkPolyDataNormals()
+            normals.SetInputData(clean_filter.GetOutput())
+            normals.ComputePointNormalsOn()
+            normals.ComputeCellNormalsOn()
+            normals.SplittingOff()
+            normals.ConsistencyOn()
+            normals.AutoOrientNormalsOn()
+            normals.Update()
+            
+            final_mesh = normals.GetOutput()
         
         # Save result
-        writer = vtk.vtkPLYWriter()
-        writer.SetFileName(output_path)
-        writer.SetInputData(final_mesh)
-        writer.Write()
+        Utils3D.write_surface_ply(final_mesh, output_path)
         
         # Verify result
         final_bounds = final_mesh.GetBounds()
-        final_center = np.mean([[final_bounds[0], final_bounds[2], final_bounds[4]],
-                               [final_bounds[1], final_bounds[3], final_bounds[5]]], axis=0)
+        final_center = np.array([(final_bounds[0] + final_bounds[1]) / 2,
+                                 (final_bounds[2] + final_bounds[3]) / 2,
+                                 (final_bounds[4] + final_bounds[5]) / 2])
         
         print(f"\n✅ Scale-Free Anatomical Alignment Complete!")
         print(f"   Final center: {final_center}")
@@ -151,8 +141,7 @@ def create_scale_free_config():
     print("-" * 50)
     
     # Load base config
-    with open(base_config_path, 'r') as f:
-        config = json.load(f)
+    config = load_base_config(base_config_path)
     
     # Modify for scale-free alignment
     config['name'] = "MVLMModel_DTU3D"  # Use existing model name
@@ -164,11 +153,11 @@ def create_scale_free_config():
     if 'comment' in config['data_loader']['args']:
         del config['data_loader']['args']['comment']
     
-    # Save new config
-    with open(output_config_path, 'w') as f:
-        json.dump(config, f, indent=2)
-    
-    print(f"✅ Scale-free configuration created: {output_config_path}")
+    # Save new config (left untouched when it already matches)
+    if save_config_if_changed(config, output_config_path):
+        print(f"✅ Scale-free configuration created: {output_config_path}")
+    else:
+        print(f"✅ Scale-free configuration up to date: {output_config_path}")
     return output_config_path
 
 # Example usage
@@ -168,8 +168,7 @@ def visualise_landmarks_as_spheres_with_accuracy(gt_lm, pred_lm, file_out):
 
         dst = distance.euclidean(gt_p, pr_p)
 
-        for s in range(sphere.GetOutput().GetNumberOfPoints()):
-            scalars.SetValue(s, dst)
+        scalars.Fill(dst)
 
         sphere.GetOutput().GetPointData().SetScalars(scalars)
         append.AddInputData(sphere.GetOutput())
@@ -4,29 +4,42 @@ Ultimate PLY Preprocessing for Deep-MVLM
 This script aligns PLY files to OBJ coordinate system for optimal results
 """
 import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 import numpy as np
 import sys
-try:
-    from scipy.spatial import procrustes
-except ImportError:
-    print("Warning: scipy.spatial.procrustes not available, using basic alignment")
-    procrustes = None
+from functools import lru_cache
+from utils3d import Utils3D
 
-def align_ply_to_obj_system(ply_path, output_path, obj_reference="assets/testmeshA.obj"):
-    """Align PLY to OBJ coordinate system"""
-    
-    # Load OBJ reference
+@lru_cache(maxsize=None)
+def load_obj_reference(obj_reference="assets/testmeshA.obj"):
+    """Load the OBJ reference mesh once per path and return its vertices, bounds, center and diagonal
+
+    The result is shared between calls, so the arrays are read-only.
+    """
     obj_reader = vtk.vtkOBJReader()
     obj_reader.SetFileName(obj_reference)
     obj_reader.Update()
     obj_mesh = obj_reader.GetOutput()
     
-    obj_points = obj_mesh.GetPoints()
-    obj_vertices = np.array([obj_points.GetPoint(i) for i in range(obj_points.GetNumberOfPoints())])
-    obj_bounds = obj_mesh.GetBounds()
-    obj_center = np.mean(obj_vertices, axis=0)
-    obj_diagonal = np.sqrt(np.sum((np.array([obj_bounds[1], obj_bounds[3], obj_bounds[5]]) - 
-                                 np.array([obj_bounds[0], obj_bounds[2], obj_bounds[4]]))**2))
+    vertices = vtk_to_numpy(obj_mesh.GetPoints().GetData()).reshape(-1, 3).astype(np.float64)
+    mins, maxs, center = Utils3D.vertex_stats(vertices)
+    for array in (vertices, center):
+        array.flags.writeable = False
+    
+    return {
+        'vertices': vertices,
+        'bounds': tuple(np.column_stack((mins, maxs)).ravel().tolist()),  # VTK GetBounds() layout
+        'center': center,
+        'diagonal': float(np.linalg.norm(maxs - mins))
+    }
+
+def align_ply_to_obj_system(ply_path, output_path, obj_reference="assets/testmeshA.obj"):
+    """Align PLY to OBJ coordinate system"""
+    
+    # Load OBJ reference (cached across files)
+    obj_ref = load_obj_reference(obj_reference)
+    obj_center = obj_ref['center']
+    obj_diagonal = obj_ref['diagonal']
     
     # Load PLY
     ply_reader = vtk.vtkPLYReader()
@@ -34,32 +47,25 @@ def align_ply_to_obj_system(ply_path, output_path, obj_reference="assets/testmes
     ply_reader.Update()
     ply_mesh = ply_reader.GetOutput()
     
+    # Work directly on VTK's point buffer (float32 for PLY input) instead of a float64 copy
     ply_points = ply_mesh.GetPoints()
-    ply_vertices = np.array([ply_points.GetPoint(i) for i in range(ply_points.GetNumberOfPoints())])
-    ply_bounds = ply_mesh.GetBounds()
-    ply_center = np.mean(ply_vertices, axis=0)
-    ply_diagonal = np.sqrt(np.sum((np.array([ply_bounds[1], ply_bounds[3], ply_bounds[5]]) - 
-                                 np.array([ply_bounds[0], ply_bounds[2], ply_bounds[4]]))**2))
-    
-    # Create alignment transform
-    transform = vtk.vtkTransform()
-    transform.Translate(-ply_center)
+    ply_vertices = vtk_to_numpy(ply_points.GetData()).reshape(-1, 3)
+    ply_mins, ply_maxs, ply_center = Utils3D.vertex_stats(ply_vertices)
+    ply_diagonal = np.linalg.norm(ply_maxs - ply_mins)
     
+    # Apply the alignment to the vertex array directly instead of through vtkTransformPolyDataFilter.
+    # vtkTransform pre-multiplies, so Translate(-ply_center), Scale, Translate(obj_center) maps each
+    # point to (p + obj_center) * scale_factor - ply_center
+    # The constants are cast to the buffer's precision so the in-place ops stay single precision
     scale_factor = obj_diagonal / ply_diagonal
-    transform.Scale(scale_factor, scale_factor, scale_factor)
-    transform.Translate(obj_center)
-    
-    # Apply transform
-    transform_filter = vtk.vtkTransformPolyDataFilter()
-    transform_filter.SetInputData(ply_mesh)
-    transform_filter.SetTransform(transform)
-    transform_filter.Update()
+    point_dtype = ply_vertices.dtype
+    ply_vertices += obj_center.astype(point_dtype)
+    ply_vertices *= point_dtype.type(scale_factor)
+    ply_vertices -= ply_center.astype(point_dtype)
+    ply_points.Modified()
     
     # Save result
-    writer = vtk.vtkPLYWriter()
-    writer.SetFileName(output_path)
-    writer.SetInputData(transform_filter.GetOutput())
-    writer.Write()
+    Utils3D.write_surface_ply(ply_mesh, output_path)
     
     print(f"PLY aligned and saved to: {output_path}")
     print(f"Scale factor: {scale_factor:.6f}")
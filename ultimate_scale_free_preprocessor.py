@@ -4,21 +4,32 @@ Ultimate Scale-Free PLY Preprocessor
 This script aligns PLY files to OBJ coordinate system WITHOUT scale changes
 """
 import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 import numpy as np
 import sys
 import os
-try:
-    from scipy.spatial import procrustes
-except ImportError:
-    print("Warning: scipy.spatial.procrustes not available, using basic alignment")
-    procrustes = None
+import glob
+import math
+from functools import lru_cache
+from ultimate_ply_preprocessor import load_obj_reference
+from utils3d import Utils3D
 
 class UltimateScaleFreePreprocessor:
+    # Vertices sampled per mesh for the PCA axes; the principal axes of a face scan are settled
+    # well before this many points, so the covariance no longer streams the whole mesh
+    PCA_SAMPLE_SIZE = 20000
+    
     def __init__(self):
         self.preserve_scale = True
     
-    def align_ply_to_obj_system_scale_free(self, ply_path, output_path, obj_reference="assets/testmeshA.obj"):
-        """Align PLY to OBJ coordinate system without scale changes"""
+    def align_ply_to_obj_system_scale_free(self, ply_path, output_path, obj_reference="assets/testmeshA.obj", mesh=None,
+                                           clean=False):
+        """Align PLY to OBJ coordinate system without scale changes
+
+        Pass an already loaded vtkPolyData as ``mesh`` to avoid parsing the PLY again. The rigid
+        transform keeps the mesh topology valid, so vtkCleanPolyData only runs with ``clean=True``
+        (to merge duplicate points the scan itself may contain).
+        """
         
         print(f"\n🎯 Ultimate Scale-Free PLY Preprocessing")
         print(f"Input: {os.path.basename(ply_path)}")
@@ -27,37 +38,34 @@ class UltimateScaleFreePreprocessor:
         print("⚠️  SCALE PRESERVATION MODE - Manual landmarks will remain valid")
         print("=" * 70)
         
-        # Load OBJ reference
-        obj_reader = vtk.vtkOBJReader()
-        obj_reader.SetFileName(obj_reference)
-        obj_reader.Update()
-        obj_mesh = obj_reader.GetOutput()
-        
-        obj_points = obj_mesh.GetPoints()
-        obj_vertices = np.array([obj_points.GetPoint(i) for i in range(obj_points.GetNumberOfPoints())])
-        obj_bounds = obj_mesh.GetBounds()
-        obj_center = np.mean(obj_vertices, axis=0)
-        obj_diagonal = np.sqrt(np.sum((np.array([obj_bounds[1], obj_bounds[3], obj_bounds[5]]) - 
-                                     np.array([obj_bounds[0], obj_bounds[2], obj_bounds[4]]))**2))
+        # Load OBJ reference (cached across files)
+        obj_ref = load_obj_reference(obj_reference)
+        obj_vertices = obj_ref['vertices']
+        obj_bounds = obj_ref['bounds']
+        obj_center = obj_ref['center']
+        obj_diagonal = obj_ref['diagonal']
         
         print(f"\n📊 OBJ Reference Analysis:")
-        print(f"   Points: {obj_points.GetNumberOfPoints():,}")
+        print(f"   Points: {len(obj_vertices):,}")
         print(f"   Center: {obj_center}")
         print(f"   Diagonal: {obj_diagonal:.1f}")
         print(f"   Bounds: X[{obj_bounds[0]:.1f}, {obj_bounds[1]:.1f}] Y[{obj_bounds[2]:.1f}, {obj_bounds[3]:.1f}] Z[{obj_bounds[4]:.1f}, {obj_bounds[5]:.1f}]")
         
         # Load PLY
-        ply_reader = vtk.vtkPLYReader()
-        ply_reader.SetFileName(ply_path)
-        ply_reader.Update()
-        ply_mesh = ply_reader.GetOutput()
+        if mesh is None:
+            ply_reader = vtk.vtkPLYReader()
+            ply_reader.SetFileName(ply_path)
+            ply_reader.Update()
+            mesh = ply_reader.GetOutput()
+        ply_mesh = mesh
         
         ply_points = ply_mesh.GetPoints()
-        ply_vertices = np.array([ply_points.GetPoint(i) for i in range(ply_points.GetNumberOfPoints())])
-        ply_bounds = ply_mesh.GetBounds()
-        ply_center = np.mean(ply_vertices, axis=0)
-        ply_diagonal = np.sqrt(np.sum((np.array([ply_bounds[1], ply_bounds[3], ply_bounds[5]]) - 
-                                     np.array([ply_bounds[0], ply_bounds[2], ply_bounds[4]]))**2))
+        # Zero-copy view of the point buffer; the stats and PCA upcast as they read it
+        ply_vertices = vtk_to_numpy(ply_points.GetData()).reshape(-1, 3)
+        ply_mins, ply_maxs, ply_center = Utils3D.vertex_stats(ply_vertices)
+        # Bounds in VTK GetBounds() order from the same pass, instead of a second scan by VTK
+        ply_bounds = tuple(np.column_stack((ply_mins, ply_maxs)).ravel().tolist())
+        ply_diagonal = np.linalg.norm(ply_maxs - ply_mins)
         
         print(f"\n📊 PLY Input Analysis:")
         print(f"   Points: {ply_points.GetNumberOfPoints():,}")
@@ -78,23 +86,21 @@ class UltimateScaleFreePreprocessor:
         print(f"   Translation vector: {translation}")
         
         # Estimate rotation by comparing orientations
-        rotation_matrix = self.estimate_rotation_alignment(ply_vertices, obj_vertices)
+        rotation_matrix = self.estimate_rotation_alignment(ply_vertices, obj_vertices,
+                                                           ply_center, obj_center,
+                                                           obj_axes=reference_pca_axes(obj_reference))
         print(f"   Rotation matrix computed: {rotation_matrix.shape}")
         
-        # Create alignment transform WITHOUT SCALE
-        transform = vtk.vtkTransform()
-        transform.PostMultiply()
-        
+        # Compose the alignment WITHOUT SCALE into one 4x4 matrix and apply it in a single
+        # NumPy pass over the points (topology and attributes are shared, not copied)
         # 1. Center PLY to origin
-        transform.Translate(-ply_center)
+        to_origin = np.eye(4)
+        to_origin[:3, 3] = -ply_center
         
         # 2. Apply rotation if computed
+        rotate = np.eye(4)
         if rotation_matrix is not None:
-            vtk_matrix = vtk.vtkMatrix4x4()
-            for i in range(3):
-                for j in range(3):
-                    vtk_matrix.SetElement(i, j, rotation_matrix[i, j])
-            transform.Concatenate(vtk_matrix)
+            rotate[:3, :3] = rotation_matrix
             print(f"   ✅ Rotation applied")
         else:
             print(f"   ⚠️  No rotation applied (using translation only)")
@@ -102,37 +108,33 @@ class UltimateScaleFreePreprocessor:
         # 3. NO SCALE APPLIED - This preserves manual landmark coordinates!
         
         # 4. Translate to OBJ center
-        transform.Translate(obj_center)
+        to_obj = np.eye(4)
+        to_obj[:3, 3] = obj_center
         
         # Apply transform
-        transform_filter = vtk.vtkTransformPolyDataFilter()
-        transform_filter.SetInputData(ply_mesh)
-        transform_filter.SetTransform(transform)
-        transform_filter.Update()
-        
-        # Preserve color and texture data if present
-        transformed_mesh = transform_filter.GetOutput()
-        
-        # Clean up the result (minimal processing)
-        clean_filter = vtk.vtkCleanPolyData()
-        clean_filter.SetInputData(transformed_mesh)
-        clean_filter.Update()
-        
-        final_mesh = clean_filter.GetOutput()
+        transformed_mesh = Utils3D.transform_points(ply_mesh, to_obj @ rotate @ to_origin)
+        
+        final_mesh = transformed_mesh
+        if clean:
+            # Clean up the result (minimal processing)
+            clean_filter = vtk.vtkCleanPolyData()
+            clean_filter.SetInputData(transformed_mesh)
+            clean_filter.Update()
+            
+            final_mesh = clean_filter.GetOutput()
         
         # Save result
-        writer = vtk.vtkPLYWriter()
-        writer.SetFileName(output_path)
-        writer.SetInputData(final_mesh)
-        writer.SetDataByteOrderToLittleEndian()
-        writer.Write()
+        Utils3D.write_surface_ply(final_mesh, output_path)
         
         # Verify result
         final_bounds = final_mesh.GetBounds()
-        final_center = np.mean([[final_bounds[0], final_bounds[2], final_bounds[4]],
-                               [final_bounds[1], final_bounds[3], final_bounds[5]]], axis=0)
-        final_diagonal = np.sqrt(np.sum((np.array([final_bounds[1], final_bounds[3], final_bounds[5]]) - 
-                                       np.array([final_bounds[0], final_bounds[2], final_bounds[4]]))**2))
+        final_center = np.array([(final_bounds[0] + final_bounds[1]) / 2,
+                                 (final_bounds[2] + final_bounds[3]) / 2,
+                                 (final_bounds[4] + final_bounds[5]) / 2])
+        dx = final_bounds[1] - final_bounds[0]
+        dy = final_bounds[3] - final_bounds[2]
+        dz = final_bounds[5] - final_bounds[4]
+        final_diagonal = math.sqrt(dx * dx + dy * dy + dz * dz)
         
         print(f"\n✅ Ultimate Scale-Free Alignment Complete!")
         print(f"   Final center: {final_center}")
@@ -152,21 +154,37 @@ class UltimateScaleFreePreprocessor:
             'output_file': output_path
         }
     
-    def estimate_rotation_alignment(self, ply_vertices, obj_vertices):
-        """Estimate rotation to align PLY with OBJ orientation"""
+    @classmethod
+    def pca_axes(cls, vertices, center=None):
+        """Principal axes of a vertex array as columns, by descending variance"""
+        if center is None:
+            center = np.mean(vertices, axis=0, dtype=np.float64)
+        # The center stays the mean of all vertices; only the covariance is sampled, with a
+        # fixed seed so a mesh always gets the same sample and the same axes
+        if len(vertices) > cls.PCA_SAMPLE_SIZE:
+            rng = np.random.default_rng(0)
+            vertices = vertices[rng.choice(len(vertices), size=cls.PCA_SAMPLE_SIZE, replace=False)]
+        # The center is known, so the covariance is one pass about it instead of np.cov
+        # re-centering another copy. eig (not eigh) keeps the axis signs the rotation has
+        # always been estimated with
+        cov_matrix = Utils3D.covariance(vertices, center)
+        eigenvalues, eigenvectors = np.linalg.eig(cov_matrix)
+        # Sort by eigenvalues (descending)
+        idx = np.argsort(eigenvalues)[::-1]
+        return eigenvectors[:, idx]
+    
+    def estimate_rotation_alignment(self, ply_vertices, obj_vertices, ply_center=None, obj_center=None,
+                                    obj_axes=None):
+        """Estimate rotation to align PLY with OBJ orientation
+
+        Centers already known to the caller are reused instead of another pass over the vertices,
+        and precomputed OBJ axes (see reference_pca_axes) skip the reference PCA altogether.
+        """
         try:
             # Use PCA to estimate principal axes
-            def compute_pca_axes(vertices):
-                center = np.mean(vertices, axis=0)
-                centered = vertices - center
-                cov_matrix = np.cov(centered.T)
-                eigenvalues, eigenvectors = np.linalg.eig(cov_matrix)
-                # Sort by eigenvalues (descending)
-                idx = np.argsort(eigenvalues)[::-1]
-                return eigenvectors[:, idx]
-            
-            ply_axes = compute_pca_axes(ply_vertices)
-            obj_axes = compute_pca_axes(obj_vertices)
+            ply_axes = self.pca_axes(ply_vertices, ply_center)
+            if obj_axes is None:
+                obj_axes = self.pca_axes(obj_vertices, obj_center)
             
             # Calculate rotation matrix: R = obj_axes * ply_axes^T
             rotation_matrix = obj_axes @ ply_axes.T
@@ -181,10 +199,20 @@ class UltimateScaleFreePreprocessor:
             print(f"   ⚠️  Rotation estimation failed: {e}")
             return None
 
+
+@lru_cache(maxsize=None)
+def reference_pca_axes(obj_reference="assets/testmeshA.obj"):
+    """PCA axes of the OBJ reference, computed once per path and shared read-only like the reference"""
+    obj_ref = load_obj_reference(obj_reference)
+    axes = UltimateScaleFreePreprocessor.pca_axes(obj_ref['vertices'], obj_ref['center'])
+    axes.flags.writeable = False
+    return axes
+
 # Stand-alone execution
 def main():
     if len(sys.argv) < 3:
         print("Usage: python ultimate_scale_free_preprocessor.py input.ply output.ply [obj_reference]")
+        print("       python ultimate_scale_free_preprocessor.py 'scans/*.ply' output_dir [obj_reference]")
         print("Example: python ultimate_scale_free_preprocessor.py input.ply aligned.ply assets/testmeshA.obj")
         sys.exit(1)
     
@@ -192,7 +220,12 @@ def main():
     output_ply = sys.argv[2]
     obj_reference = sys.argv[3] if len(sys.argv) > 3 else "assets/testmeshA.obj"
     
-    if not os.path.exists(input_ply):
+    # A glob pattern aligns every match into the output directory in this one process, so the OBJ
+    # reference and its PCA axes are parsed once for the whole batch instead of once per file
+    batch = glob.has_magic(input_ply)
+    input_plys = sorted(glob.glob(input_ply)) if batch else [input_ply]
+    
+    if not input_plys or not os.path.exists(input_plys[0]):
         print(f"❌ Input PLY file not found: {input_ply}")
         sys.exit(1)
     
@@ -200,11 +233,16 @@ def main():
         print(f"❌ OBJ reference file not found: {obj_reference}")
         sys.exit(1)
     
+    if batch:
+        os.makedirs(output_ply, exist_ok=True)
+    
     processor = UltimateScaleFreePreprocessor()
-    result = processor.align_ply_to_obj_system_scale_free(input_ply, output_ply, obj_reference)
+    for ply_file in input_plys:
+        output_file = os.path.join(output_ply, os.path.basename(ply_file)) if batch else output_ply
+        result = processor.align_ply_to_obj_system_scale_free(ply_file, output_file, obj_reference)
     
     print(f"\n🎯 Ultimate Scale-Free Processing Summary:")
-    print(f"   Input: {input_ply}")
+    print(f"   Input: {input_ply}" + (f" ({len(input_plys)} files)" if batch else ""))
     print(f"   Output: {output_ply}")
     print(f"   Scale preserved: ✅")
     print(f"   Ready for prediction with manual landmarks!")
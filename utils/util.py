@@ -1,8 +1,30 @@
+import copy
 import json
+import os
+import signal
+import tempfile
+import threading
 from pathlib import Path
 from datetime import datetime
 from itertools import repeat
 from collections import OrderedDict
+from functools import lru_cache
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+REPORT_BUFFER_SIZE = 64 * 1024
+
+# repo-local root of every on-disk cache, so deleting this one directory clears them all
+CACHE_DIR = ".cache"
 
 
 def ensure_dir(dirname):
@@ -21,6 +43,84 @@ def write_json(content, fname):
         json.dump(content, handle, indent=4, sort_keys=False)
 
 
+def fast_temp_dir():
+    # prefer RAM-backed tmpfs for short-lived intermediate meshes
+    for candidate in ('/dev/shm', os.environ.get('XDG_RUNTIME_DIR')):
+        if candidate and os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+            return candidate
+    return tempfile.gettempdir()
+
+
+def load_report_json(path):
+    # analysis reports are plain lists/dicts, so orjson can decode them when available
+    with open(path, 'rb', buffering=REPORT_BUFFER_SIZE) as handle:
+        data = handle.read()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def save_report_json(content, path, default=None):
+    if orjson is not None:
+        data = orjson.dumps(content, default=default,
+                            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        data = json.dumps(content, indent=2, default=default).encode('utf-8')
+    with open(path, 'wb', buffering=REPORT_BUFFER_SIZE) as handle:
+        handle.write(data)
+
+
+def iter_report_items(path):
+    # records of a top-level JSON array one at a time; with ijson they are streamed from disk,
+    # so a large report is never held in memory as a whole
+    if ijson is None:
+        yield from load_report_json(path)
+        return
+    with open(path, 'rb', buffering=REPORT_BUFFER_SIZE) as handle:
+        yield from ijson.items(handle, 'item', use_float=True)
+
+
+@lru_cache(maxsize=None)
+def _parse_config_json(path, mtime_ns):
+    return load_report_json(path)
+
+
+def load_base_config(path):
+    # parsed once per process and file version; callers get a private copy they may mutate
+    return copy.deepcopy(_parse_config_json(path, os.stat(path).st_mtime_ns))
+
+
+def save_config_if_changed(config, path, indent=2):
+    # derived configs come out the same on every run, so only write when the file is missing
+    # or stale; returns whether the file was written
+    if os.path.exists(path) and load_base_config(path) == config:
+        return False
+    with open(path, 'w') as handle:
+        json.dump(config, handle, indent=indent)
+    return True
+
+
+@contextmanager
+def time_limit(seconds):
+    # raise TimeoutError in the block once seconds have passed, the in-process counterpart of a
+    # subprocess timeout; SIGALRM only reaches the main thread, which is where pool workers run
+    # their tasks, so elsewhere (or with seconds=None) the block runs unbounded
+    if seconds is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise TimeoutError(f"timed out after {seconds:g} s")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
 def inf_loop(data_loader):
     # wrapper function for endless data loader.
     for loader in repeat(data_loader):
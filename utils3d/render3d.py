@@ -253,6 +253,7 @@ class Render3D:
             writer = vtk.vtkPolyDataWriter()
             writer.SetInputData(trans.GetOutput())
             writer.SetFileName(name_out)
+            writer.SetFileTypeToBinary()  # whole mesh; the ASCII default is several times larger and slower
             writer.Write()
 
         return trans.GetOutput()
@@ -304,17 +305,15 @@ class Render3D:
         t.Identity()
         t.Update()
 
-        # Transform (assuming only one mesh)
-        trans = vtk.vtkTransformPolyDataFilter()
-        trans.SetInputData(pd)
-        trans.SetTransform(t)
-        trans.Update()
-
+        # The mesh is rendered untouched; both actors apply the view transform while drawing,
+        # so no transformed copy of the mesh is made per view (assuming only one mesh)
+        pd_vertices = vtk_to_numpy(pd.GetPoints().GetData())
         mapper = vtk.vtkPolyDataMapper()
-        mapper.SetInputData(trans.GetOutput())
+        mapper.SetInputData(pd)
 
         actor_text = vtk.vtkActor()
         actor_text.SetMapper(mapper)
+        actor_text.SetUserTransform(t)
         if texture_img is not None:
             actor_text.SetTexture(texture)
             actor_text.GetProperty().SetColor(1, 1, 1)
@@ -325,6 +324,7 @@ class Render3D:
 
         actor_geometry = vtk.vtkActor()
         actor_geometry.SetMapper(mapper)
+        actor_geometry.SetUserTransform(t)
         ren.AddActor(actor_geometry)
 
         w2if = vtk.vtkWindowToImageFilter()
@@ -354,14 +354,16 @@ class Render3D:
             t.RotateX(rx)
             t.RotateZ(rz)
             t.Update()
-            trans.Update()
+            m = t.GetMatrix()
 
             xmin = -150
             xmax = 150
             ymin = -150
             ymax = 150
-            zmin = trans.GetOutput().GetBounds()[4]
-            zmax = trans.GetOutput().GetBounds()[5]
+            # Only the depth range of the transformed mesh is needed for the clipping planes
+            z_pos = pd_vertices @ [m.GetElement(2, 0), m.GetElement(2, 1), m.GetElement(2, 2)] + m.GetElement(2, 3)
+            zmin = z_pos.min()
+            zmax = z_pos.max()
             xlen = xmax - xmin
             ylen = ymax - ymin
 
@@ -460,7 +462,7 @@ class Render3D:
             actor_text.SetVisibility(True)
             ren.Modified()
 
-        del writer_png_2, writer_png, ren_win, actor_geometry, actor_text, mapper, w2if, t, trans
+        del writer_png_2, writer_png, ren_win, actor_geometry, actor_text, mapper, w2if, t, pd_vertices
         if texture_img is not None:
             del texture_img
             del texture
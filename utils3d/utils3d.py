@@ -1,6 +1,92 @@
 import numpy as np
 import vtk
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
 import os
+from functools import lru_cache
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+# rows staged per block when writing binary PLY
+PLY_WRITE_CHUNK = 1 << 16
+MESH_EXTENSIONS = ('.obj', '.wrl', '.vtk', '.vtp', '.ply', '.stl')
+
+
+def _vertex_stats_loop(vertices):
+    # min, max and mean of an (n, 3) array in a single sweep over the rows
+    mins = vertices[0].copy()
+    maxs = vertices[0].copy()
+    sums = np.zeros(3)
+    for i in range(vertices.shape[0]):
+        for k in range(3):
+            x = vertices[i, k]
+            sums[k] += x
+            if x < mins[k]:
+                mins[k] = x
+            if x > maxs[k]:
+                maxs[k] = x
+    return mins, maxs, sums / vertices.shape[0]
+
+
+_vertex_stats_kernel = njit(fastmath=True, cache=True)(_vertex_stats_loop) if njit is not None else None
+
+
+def _frame_rotation_loop(from_nose, from_up, to_nose, to_up):
+    # rotation carrying the orthonormal (right, up, nose) frame of the first pair of directions onto
+    # that of the second pair: R = to_frame @ from_frame.T, written out so it compiles without BLAS
+    frames = np.empty((2, 3, 3))
+    for f in range(2):
+        nose = from_nose if f == 0 else to_nose
+        up = from_up if f == 0 else to_up
+        nose = nose / np.linalg.norm(nose)
+        up = up / np.linalg.norm(up)
+        right = np.cross(up, nose)
+        right = right / np.linalg.norm(right)
+        up = np.cross(nose, right)  # Ensure orthogonality
+        frames[f, :, 0] = right
+        frames[f, :, 1] = up
+        frames[f, :, 2] = nose
+    rotation = np.zeros((3, 3))
+    for i in range(3):
+        for j in range(3):
+            for k in range(3):
+                rotation[i, j] += frames[1, i, k] * frames[0, j, k]
+    return rotation
+
+
+_frame_rotation_kernel = njit(cache=True)(_frame_rotation_loop) if njit is not None else None
+
+
+def _covariance_loop(vertices, center):
+    # sample covariance of an (n, 3) array about a known center, accumulated in one sweep without
+    # materialising the centered copy
+    scatter = np.zeros((3, 3))
+    for i in range(vertices.shape[0]):
+        x = vertices[i, 0] - center[0]
+        y = vertices[i, 1] - center[1]
+        z = vertices[i, 2] - center[2]
+        scatter[0, 0] += x * x
+        scatter[0, 1] += x * y
+        scatter[0, 2] += x * z
+        scatter[1, 1] += y * y
+        scatter[1, 2] += y * z
+        scatter[2, 2] += z * z
+    scatter[1, 0] = scatter[0, 1]
+    scatter[2, 0] = scatter[0, 2]
+    scatter[2, 1] = scatter[1, 2]
+    return scatter / (vertices.shape[0] - 1)
+
+
+_covariance_kernel = njit(fastmath=True, cache=True)(_covariance_loop) if njit is not None else None
+
+
+@lru_cache(maxsize=4)
+def _read_surface_cached(file_name, mtime_ns, size):
+    # keyed on modification time and size so a rewritten file is read again
+    return Utils3D.read_surface(file_name)
 
 
 class Utils3D:
@@ -11,6 +97,7 @@ class Utils3D:
         self.lm_start = None
         self.lm_end = None
         self.landmarks = None
+        self.ransac_average_error = None
         self.logger = config.get_logger('Utils3D')
 
     def read_heatmap_maxima(self, dir_name=None):
@@ -310,10 +397,81 @@ class Utils3D:
                 p_intersect, best_error = self.compute_intersection_between_lines_ransac(pa, pb)
                 sum_error = sum_error + best_error
             self.landmarks[lm_no, :] = p_intersect
-        print("Ransac average error ", sum_error/n_landmarks)
+        self.ransac_average_error = sum_error/n_landmarks
+        print("Ransac average error ", self.ransac_average_error)
 
     @staticmethod
     def multi_read_surface(file_name):
+        # One prediction reads the same mesh for pre-alignment, rendering and surface projection,
+        # so parse it once per file version and hand out shallow copies (callers may reset scalars)
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return Utils3D.read_surface(file_name)
+        pd = _read_surface_cached(file_name, stat.st_mtime_ns, stat.st_size)
+        if pd is None:
+            return None
+        pd_copy = vtk.vtkPolyData()
+        pd_copy.ShallowCopy(pd)
+        return pd_copy
+
+    @staticmethod
+    def vertex_stats(vertices):
+        # bounds and center of a vertex array (float32 or float64, the center is always summed in
+        # double); one compiled pass when numba is available, otherwise three NumPy reductions
+        if _vertex_stats_kernel is not None and len(vertices):
+            return _vertex_stats_kernel(np.ascontiguousarray(vertices))
+        return vertices.min(axis=0), vertices.max(axis=0), vertices.mean(axis=0, dtype=np.float64)
+
+    @staticmethod
+    def covariance(vertices, center):
+        # 3x3 sample covariance about center; one compiled pass when numba is available,
+        # otherwise a centered copy and one matrix product
+        center = np.asarray(center, dtype=np.float64)
+        if _covariance_kernel is not None and len(vertices) > 1:
+            return _covariance_kernel(np.ascontiguousarray(vertices), center)
+        centered = vertices - center
+        return centered.T @ centered / (len(centered) - 1)
+
+    @staticmethod
+    def frame_rotation(from_nose, from_up, to_nose, to_up):
+        # compiled when numba is available; the directions are taken as float64 3-vectors
+        args = [np.asarray(v, dtype=np.float64) for v in (from_nose, from_up, to_nose, to_up)]
+        if _frame_rotation_kernel is not None:
+            return _frame_rotation_kernel(*args)
+        return _frame_rotation_loop(*args)
+
+    @staticmethod
+    def transform_points(pd, matrix):
+        # apply a 4x4 affine matrix to every point in one numpy pass and return a shallow copy of pd
+        # with the new points; point normals are carried along with the inverse transpose and
+        # renormalised, as vtkTransformPolyDataFilter does. The points are transformed in their own
+        # precision (float32 for PLY input), so no double copy of the mesh is streamed; results stay
+        # within one float32 ulp of VTK's double-precision filter
+        matrix = np.asarray(matrix, dtype=np.float64)
+        vertices = vtk_to_numpy(pd.GetPoints().GetData())
+        point_matrix = matrix.astype(vertices.dtype)
+        moved = vertices @ point_matrix[:3, :3].T
+        moved += point_matrix[:3, 3]
+        points = vtk.vtkPoints()
+        points.SetData(numpy_to_vtk(moved, deep=1))
+        transformed = vtk.vtkPolyData()
+        transformed.ShallowCopy(pd)
+        transformed.SetPoints(points)
+
+        normals = pd.GetPointData().GetNormals()
+        if normals is not None:
+            old_normals = vtk_to_numpy(normals)
+            new_normals = old_normals @ np.linalg.inv(matrix[:3, :3]).astype(old_normals.dtype)
+            lengths = np.linalg.norm(new_normals, axis=1, keepdims=True)
+            np.divide(new_normals, lengths, out=new_normals, where=lengths > 0)
+            normal_array = numpy_to_vtk(new_normals, deep=1)
+            normal_array.SetName(normals.GetName())
+            transformed.GetPointData().SetNormals(normal_array)
+        return transformed
+
+    @staticmethod
+    def read_surface(file_name):
         clean_name, file_extension = os.path.splitext(file_name)
         if file_extension == ".obj":
             obj_in = vtk.vtkOBJReader()
@@ -430,6 +588,7 @@ class Utils3D:
             writer = vtk.vtkPolyDataWriter()
             writer.SetInputData(trans.GetOutput())
             writer.SetFileName(name_out)
+            writer.SetFileTypeToBinary()  # whole mesh; the ASCII default is several times larger and slower
             writer.Write()
 
         return trans.GetOutput(), t
@@ -451,12 +610,8 @@ class Utils3D:
         trans.Update()
         pd_trans = trans.GetOutput()
 
-        n_landmarks = pd_trans.GetNumberOfPoints()
-        new_landmarks = np.zeros((n_landmarks, 3))
-        for lm_no in range(pd_trans.GetNumberOfPoints()):
-            p = pd_trans.GetPoint(lm_no)
-            new_landmarks[lm_no, :] = (p[0], p[1], p[2])
-        return new_landmarks
+        # one copy out of the point buffer instead of a GetPoint() call per landmark
+        return vtk_to_numpy(pd_trans.GetPoints().GetData()).astype(np.float64)
 
     # Project found landmarks to closest point on the target surface
     # return the landmarks in the original space
@@ -565,13 +720,79 @@ class Utils3D:
 
         f.close()
 
+    @staticmethod
+    def write_surface_ply(pd, file_name):
+        # Triangle meshes (with optional normals) are written as binary little-endian PLY straight
+        # from numpy, one block per element; anything else goes through vtkPLYWriter. Like
+        # vtkPLYWriter's default colour mode, point scalars are not written.
+        point_data = pd.GetPointData()
+        normals = point_data.GetNormals()
+        polys = pd.GetPolys()
+        n_points = pd.GetNumberOfPoints()
+        n_faces = polys.GetNumberOfCells()
+
+        if (n_faces == 0 or pd.GetNumberOfCells() != n_faces or polys.IsHomogeneous() != 3
+                or point_data.GetTCoords() is not None):
+            writer = vtk.vtkPLYWriter()
+            writer.SetFileName(file_name)
+            writer.SetFileTypeToBinary()
+            writer.SetDataByteOrderToLittleEndian()
+            writer.SetInputData(pd)
+            writer.Write()
+            return
+
+        header = ['ply', 'format binary_little_endian 1.0', 'element vertex %d' % n_points,
+                  'property float x', 'property float y', 'property float z']
+        vertex_type = [('point', '<f4', 3)]
+        if normals is not None:
+            header += ['property float nx', 'property float ny', 'property float nz']
+            vertex_type.append(('normal', '<f4', 3))
+        header += ['element face %d' % n_faces, 'property list uchar int vertex_indices', 'end_header']
+
+        # Both blocks are interleaved through one cache-sized staging buffer per element instead
+        # of a second full-size copy of the mesh, so large meshes stream straight to the file
+        points = vtk_to_numpy(pd.GetPoints().GetData())
+        point_normals = vtk_to_numpy(normals) if normals is not None else None
+        connectivity = vtk_to_numpy(polys.GetConnectivityArray()).reshape(-1, 3)
+        step = PLY_WRITE_CHUNK
+
+        with open(file_name, 'wb') as f:
+            f.write(('\n'.join(header) + '\n').encode('ascii'))
+
+            vertices = np.empty(min(step, n_points), dtype=vertex_type)
+            for start in range(0, n_points, step):
+                chunk = vertices[:min(step, n_points - start)]
+                chunk['point'] = points[start:start + step]
+                if point_normals is not None:
+                    chunk['normal'] = point_normals[start:start + step]
+                chunk.tofile(f)
+
+            faces = np.empty(min(step, n_faces), dtype=[('n', 'u1'), ('indices', '<i4', 3)])
+            faces['n'] = 3
+            for start in range(0, n_faces, step):
+                chunk = faces[:min(step, n_faces - start)]
+                chunk['indices'] = connectivity[start:start + step]
+                chunk.tofile(f)
+
+    @staticmethod
+    def scan_mesh_files(directory, extensions=MESH_EXTENSIONS):
+        # same order as os.walk (a directory's files before its subdirectories), but each
+        # DirEntry is yielded as it is read, so callers can stop early and reuse its cached stat
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        yield entry
+        except OSError:
+            return
+        for subdir in subdirs:
+            yield from Utils3D.scan_mesh_files(subdir, extensions)
+
     @staticmethod
     def get_mesh_files_in_dir(directory):
-        names = []
-        for root, dirs, files in os.walk(directory):
-            for filename in files:
-                if filename.lower().endswith(('.obj', '.wrl', '.vtk', '.vtp', '.ply', '.stl')):
-                    full_name = os.path.join(root, filename)
-                    if os.path.isfile(full_name) and os.stat(full_name).st_size > 5:
-                        names.append(full_name)
-        return names
+        return [entry.path for entry in Utils3D.scan_mesh_files(directory)
+                if entry.is_file() and entry.stat().st_size > 5]